@@ -1,58 +1,37 @@
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
-import joblib
+from recommender import RecommenderEngine, exclude_own_ids, rank_neighbors
+from recommender_backends import RECOMMENDER_BACKEND, make_backend
 
-def train_model(crop_data):
+def extract_features(items):
     # Feature engineering
     features = []
-    for crop in crop_data:
+    for item in items:
         features.append([
-            len(crop['name']),        # Name length
-            float(crop['price']),     # Price
-            float(crop['quantity']),  # Quantity
-            1 if 'vegetable' in crop['type'].lower() else 0,
-            1 if 'fruit' in crop['type'].lower() else 0
+            len(item['name']),        # Name length
+            float(item['price']),     # Price
+            float(item.get('quantity', 1)),  # Quantity
+            1 if 'vegetable' in item['type'].lower() else 0,
+            1 if 'fruit' in item['type'].lower() else 0
         ])
-    
-    X = np.array(features)
-    model = NearestNeighbors(n_neighbors=3, metric='cosine')
-    model.fit(X)
-    joblib.dump(model, 'crop_model.joblib')
-    return model
+    return np.array(features, dtype=float)
+
+def train_model(crop_data):
+    X = extract_features(crop_data)
+    return make_backend(RECOMMENDER_BACKEND, n_neighbors=3).fit(X)
+
+# Its own artifact: ai_service's trainer would reject and overwrite a shared one
+recommender = RecommenderEngine(train_model, model_path='ai_recommendations_model.joblib', tag=RECOMMENDER_BACKEND)
 
 def get_ai_recommendations(cart_items, supabase):
    
-    all_crops = supabase.table('crops').select('*').execute().data
+    model, all_crops, crop_ids = recommender.get(supabase)
     
+    if not cart_items or not all_crops:
+        return []
     
-    try:
-        model = joblib.load('crop_model.joblib')
-    except:
-        model = train_model(all_crops)
-    
-    recommendations = []
-    
-    for item in cart_items:
-        item_features = [
-            len(item['name']),
-            float(item['price']),
-            float(item.get('quantity', 1)),
-            1 if 'vegetable' in item['type'].lower() else 0,
-            1 if 'fruit' in item['type'].lower() else 0
-        ]
-        
-        distances, indices = model.kneighbors([item_features])
-        
-        for idx in indices[0]:
-            if all_crops[idx]['id'] != item.get('id'):
-                recommendations.append(all_crops[idx])
-    
-   
-    unique_recs = []
-    seen_ids = set()
-    for crop in recommendations:
-        if crop['id'] not in seen_ids:
-            unique_recs.append(crop)
-            seen_ids.add(crop['id'])
+    # One query for the whole cart instead of one per item
+    similarity, indices = model.query(extract_features(cart_items), min(3, len(all_crops)))
+    similarity = exclude_own_ids(similarity, crop_ids[indices], cart_items)
     
-    return unique_recs[:3]  
\ No newline at end of file
+    positions, _ = rank_neighbors(similarity, indices, 3, sort=False)
+    return [all_crops[pos] for pos in positions]  
\ No newline at end of file
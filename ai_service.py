@@ -1,98 +1,297 @@
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
-import joblib
-from flask import Flask, jsonify, request, send_file
-from supabase import create_client
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
+from supabase import ClientOptions, create_client
 import os
 from dotenv import load_dotenv
 import uuid
+import io
+import json
+import hashlib
+import hmac
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from datetime import datetime
-import smtplib
+import atexit
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
-import tempfile
+from recommender import RecommenderEngine, exclude_own_ids, rank_neighbors
+from neighbor_table import NeighborTable
+from copurchase import COPURCHASE_WEIGHT, CoPurchaseIndex
+from recommender_backends import RECOMMENDER_BACKEND, make_backend
+from cache import LRUCache, SingleFlight
+from catalog import CROP_SEARCH_INDEX, CatalogSnapshot
+from pagination import InvalidCursor, decode_cursor, quote, split_page
+from order_store import InsufficientStock, make_order_store
+from inventory import INVENTORY_ENGINE, InventoryEngine
+from market import MARKET_DAYS, market_report, window_start
+from email_queue import EmailQueue
+from zip_stream import stream_zip
+from export_stream import EXPORT_BATCH_SIZE, EXPORT_TABLES, export_stream, parse_after
+from fast_json import encode_rows, json_response
+from data_layer import DB_POOL_SIZE, DB_TIMEOUT, QueryPool
+from metrics import init_metrics, instrument_client, timed
 
 load_dotenv()
 
 app = Flask(__name__)
+# Latency histograms on /metrics and Server-Timing headers (METRICS=1, SERVER_TIMING=1)
+init_metrics(app)
 
 # Configure Supabase
-supabase = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
+supabase = instrument_client(create_client(
+    os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'),
+    options=ClientOptions(postgrest_client_timeout=DB_TIMEOUT)
+))
+
+# Independent queries of one request run side by side (see data_layer.py)
+db = QueryPool(DB_POOL_SIZE, DB_TIMEOUT)
+
+# Bulk exports of every customer's data need this bearer token; unset turns them off
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+def is_admin():
+    """True when the request carries 'Authorization: Bearer <ADMIN_TOKEN>'"""
+    supplied = request.headers.get('Authorization', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied.encode(), f'Bearer {ADMIN_TOKEN}'.encode())
+
+# Atomic order writes (see order_store.py and create_order() in init_db.sql)
+order_store = make_order_store(supabase)
+
+# Optional in-memory stock reservations with block leases (INVENTORY_ENGINE=1)
+inventory = None
+if INVENTORY_ENGINE:
+    inventory = InventoryEngine(order_store)
+    atexit.register(inventory.close)
 
 # Email configuration
 EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
 EMAIL_PORT = os.getenv('EMAIL_PORT', 587)
 EMAIL_USER = os.getenv('EMAIL_USER')
 EMAIL_PASS = os.getenv('EMAIL_PASS')
+EMAIL_STARTTLS = os.getenv('EMAIL_STARTTLS', '1') == '1'
 
-def train_model(crop_data):
+# Confirmations are delivered in the background over a reused SMTP session
+email_queue = EmailQueue(
+    EMAIL_HOST, int(EMAIL_PORT), EMAIL_USER, EMAIL_PASS,
+    starttls=EMAIL_STARTTLS,
+    workers=int(os.getenv('EMAIL_WORKERS', 1)),
+    batch_size=int(os.getenv('EMAIL_BATCH_SIZE', 20)),
+    max_retries=int(os.getenv('EMAIL_MAX_RETRIES', 5))
+)
+atexit.register(email_queue.close)
+
+# Rendered invoices, addressed by a hash of everything that appears on them
+invoice_cache = LRUCache(maxsize=10000, max_bytes=int(os.getenv('INVOICE_CACHE_BYTES', 64 * 2**20)))
+# Render invoices in the background as soon as an order is created
+INVOICE_PRERENDER = os.getenv('INVOICE_PRERENDER', '0') == '1'
+invoice_renderer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='invoice')
+
+# Bulk exports render across processes; the pool is created on first export
+INVOICE_EXPORT_WORKERS = int(os.getenv('INVOICE_EXPORT_WORKERS', os.cpu_count() or 1))
+invoice_pool = None
+
+# Read-through cache for /api/crops, invalidated per crop on inventory writes
+crop_cache = LRUCache(
+    maxsize=int(os.getenv('CROP_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('CROP_CACHE_TTL', 30))
+)
+
+# Cached totals for paginated listings; dropped on writes that change them
+TOTALS_TTL = float(os.getenv('TOTALS_TTL', 300))
+crop_totals = LRUCache(maxsize=1024, ttl=TOTALS_TTL)
+order_totals = LRUCache(maxsize=10000, ttl=TOTALS_TTL)
+
+def extract_features(items):
+    """Feature matrix shared by training (catalog rows) and queries (cart items)"""
+    if isinstance(items, CatalogSnapshot):
+        # Same columns computed on the snapshot's arrays; type flags once per distinct type
+        flags = np.array([[1 if word in crop_type.lower() else 0 for word in ('vegetable', 'fruit', 'rice')]
+                          for crop_type in items.types], dtype=float).reshape(-1, 3)
+        quantity = items.quantities
+        return np.column_stack([
+            items.name_lengths,
+            items.prices,
+            quantity,
+            flags[items.type_codes],
+            items.prices / np.where(quantity == 0, 1, quantity)
+        ]).astype(float)
     # Enhanced feature engineering
     features = []
-    for crop in crop_data:
+    for item in items:
+        quantity = float(item.get('quantity', 1))
+        crop_type = item['type'].lower()
         features.append([
-            len(crop['name']),        # Name length
-            float(crop['price']),     # Price
-            float(crop['quantity']),  # Quantity
-            1 if 'vegetable' in crop['type'].lower() else 0,
-            1 if 'fruit' in crop['type'].lower() else 0,
-            1 if 'rice' in crop['type'].lower() else 0,
-            float(crop['price']) / float(crop['quantity'])  # Price per unit
+            len(item['name']),        # Name length
+            float(item['price']),     # Price
+            quantity,                 # Quantity
+            1 if 'vegetable' in crop_type else 0,
+            1 if 'fruit' in crop_type else 0,
+            1 if 'rice' in crop_type else 0,
+            float(item['price']) / (quantity or 1)  # Price per unit (sold-out crops count as 1)
         ])
+    return np.array(features, dtype=float)
+
+def train_model(crop_data):
+    X = extract_features(crop_data)
+    # Index type is chosen by RECOMMENDER_BACKEND (see recommender_backends.py)
+    return make_backend(RECOMMENDER_BACKEND, n_neighbors=5).fit(X)
+
+recommender = RecommenderEngine(train_model, tag=RECOMMENDER_BACKEND)
+
+def table_features(crops):
+    """Catalog vectors in the fitted backend's space, so table scores match live queries"""
+    features = extract_features(crops)
+    prepare = getattr(recommender.snapshot[0], 'prepare', None)
+    return prepare(features) if prepare else features
+
+# Precomputed neighbours (see neighbor_table.py), kept in sync with the catalog and model
+neighbor_table = NeighborTable(table_features, k=5)
+try:
+    neighbor_table.load()
+except Exception:
+    pass  # Built from the catalog on first load instead
+recommender.listeners.append(neighbor_table.sync)
+
+# Bought-together counts from the offline job in copurchase.py, if it has run
+copurchase = CoPurchaseIndex()
+try:
+    copurchase.load()
+except Exception:
+    pass
+
+# A new catalog snapshot may have added or removed crops
+recommender.listeners.append(lambda crops: crop_totals.clear())
+
+# Recommendations per canonical cart, dropped whenever the catalog or model changes
+recommendation_cache = LRUCache(maxsize=int(os.getenv('RECOMMENDATION_CACHE_SIZE', 4096)))
+recommendation_flights = SingleFlight()
+recommender.listeners.append(lambda crops: recommendation_cache.clear())
+
+def get_batch_recommendations(carts, supabase, limit=5):
+    """Recommend for many carts at once.
+
+    Cart items that are catalog crops read their precomputed neighbours; the
+    rest share a single live query against the fitted backend.
+    """
+    # Model and catalog stay in memory until the catalog version changes
+    model, catalog, crop_ids = recommender.get(supabase)
+    
+    items = [item for cart in carts for item in cart]
+    if not items or not len(catalog):
+        return [[] for _ in carts]
+    
+    with timed('knn'):
+        known, table_ids, table_scores = neighbor_table.lookup([item.get('id') for item in items])
+    neighbor_ids = np.full((len(items), neighbor_table.k), -1, dtype=object)
+    similarity = np.full((len(items), neighbor_table.k), -np.inf)
+    neighbor_ids[known] = table_ids
+    similarity[known] = table_scores
     
-    X = np.array(features)
-    model = NearestNeighbors(n_neighbors=5, metric='cosine', algorithm='brute')
-    model.fit(X)
-    joblib.dump(model, 'crop_model.joblib')
-    return model
+    # Items the table doesn't know about fall back to a live query
+    if not known.all():
+        unknown = np.flatnonzero(~known)
+        n_neighbors = min(neighbor_table.k, len(catalog))
+        with timed('knn'):
+            live_similarity, indices = model.query(extract_features([items[i] for i in unknown]), n_neighbors)
+        neighbor_ids[unknown, :n_neighbors] = crop_ids[indices]
+        similarity[unknown, :n_neighbors] = live_similarity
+    similarity = exclude_own_ids(similarity, neighbor_ids, items)
+    
+    # Rows for each cart are contiguous; rank and de-duplicate them per cart
+    results = []
+    start = 0
+    blend = COPURCHASE_WEIGHT > 0 and copurchase.counts is not None
+    for cart in carts:
+        end = start + len(cart)
+        if blend:
+            ids, scores = rank_neighbors(similarity[start:end], neighbor_ids[start:end], None)
+            ids, scores = blend_copurchase(ids, scores, cart, limit, catalog)
+        else:
+            ids, scores = rank_neighbors(similarity[start:end], neighbor_ids[start:end], limit)
+        # Only the crops being returned are turned back into dicts, with their
+        # JSON spliced from the crop's cached encoding
+        positions = catalog.positions(list(ids))
+        results.append([
+            catalog.encoded_row(position, similarity_score=float(score))
+            for position, score in zip(positions.tolist(), scores) if position >= 0
+        ])
+        start = end
+    return results
+
+def blend_copurchase(ids, scores, cart, limit, catalog):
+    """Mix bought-together scores into a cart's kNN ranking by COPURCHASE_WEIGHT"""
+    with timed('copurchase'):
+        co_ids, co_scores = copurchase.scores([item.get('id') for item in cart])
+    blended = {crop_id: (1 - COPURCHASE_WEIGHT) * score for crop_id, score in zip(ids.tolist(), scores.tolist())}
+    listed = catalog.positions(co_ids.tolist()) >= 0
+    for crop_id, score in zip(co_ids[listed].tolist(), co_scores[listed].tolist()):
+        blended[crop_id] = blended.get(crop_id, 0.0) + COPURCHASE_WEIGHT * score
+    ranked = sorted(blended.items(), key=lambda entry: -entry[1])[:limit]
+    return [crop_id for crop_id, _ in ranked], [score for _, score in ranked]
+
+def canonical_cart(cart_items):
+    """Return (signature, cart) so carts with the same crops share one result.
+
+    Catalog crops are answered from the neighbour table by id alone, so their
+    order and quantity don't matter; other items go through the model and
+    their feature values are part of the signature.
+    """
+    canonical = {}
+    for item in cart_items:
+        crop_id = item.get('id')
+        if crop_id in neighbor_table:
+            part = (0, crop_id, ())
+        else:
+            part = (1, repr(crop_id), tuple(extract_features([item])[0]))
+        canonical.setdefault(part, item)
+    signature = tuple(sorted(canonical))
+    return signature, [canonical[part] for part in signature]
 
 def get_ai_recommendations(cart_items, supabase):
     try:
-        all_crops = supabase.table('crops').select('*').execute().data
-        
-        try:
-            model = joblib.load('crop_model.joblib')
-        except:
-            model = train_model(all_crops)
-        
-        recommendations = []
-        
-        for item in cart_items:
-            item_features = [
-                len(item['name']),
-                float(item['price']),
-                float(item.get('quantity', 1)),
-                1 if 'vegetable' in item['type'].lower() else 0,
-                1 if 'fruit' in item['type'].lower() else 0,
-                1 if 'rice' in item['type'].lower() else 0,
-                float(item['price']) / float(item.get('quantity', 1))
-            ]
+        # Checks the catalog version, clearing the cache if a new snapshot is loaded
+        recommender.get(supabase)
+        if copurchase.refresh():
+            recommendation_cache.clear()
+        signature, cart = canonical_cart(cart_items)
+        recommendations = recommendation_cache.get(signature)
+        if recommendations is None:
+            generation = recommendation_cache.generation
             
-            distances, indices = model.kneighbors([item_features])
+            def compute():
+                result = get_batch_recommendations([cart], supabase)[0]
+                # Tagged with the crops shown, so an order for one of them drops it
+                recommendation_cache.set(signature, result, tags=[crop['id'] for crop in result],
+                                         generation=generation)
+                return result
             
-            for idx in indices[0]:
-                if all_crops[idx]['id'] != item.get('id'):
-                    recommendations.append({
-                        **all_crops[idx],
-                        'similarity_score': 1 - distances[0][indices[0].tolist().index(idx)]
-                    })
-        
-        # Sort by similarity score and remove duplicates
-        unique_recs = []
-        seen_ids = set()
-        for crop in sorted(recommendations, key=lambda x: x['similarity_score'], reverse=True):
-            if crop['id'] not in seen_ids:
-                unique_recs.append(crop)
-                seen_ids.add(crop['id'])
-        
-        return unique_recs[:5]
+            # Identical carts arriving together wait for one computation
+            recommendations = recommendation_flights.do(signature, compute)
+        return recommendations
     except Exception as e:
         print(f"AI Recommendation Error: {str(e)}")
         return []
 
+def filter_crops(query, search, crop_type, region):
+    if search:
+        query = query.ilike('name', f'%{search}%')
+    if crop_type:
+        query = query.eq('type', crop_type)
+    if region:
+        query = query.eq('region', region)
+    return query
+
+def count_crops(search, crop_type, region):
+    """Number of crops matching the filters, cached until the catalog changes"""
+    key = (search.lower(), crop_type, region)
+    total = crop_totals.get(key)
+    if total is None:
+        generation = crop_totals.generation
+        query = filter_crops(supabase.table('crops').select('id', count='exact'), search, crop_type, region)
+        total = query.limit(1).execute().count
+        crop_totals.set(key, total, generation=generation)
+    return total
+
 @app.route('/api/crops', methods=['GET'])
 def get_crops():
     try:
@@ -101,39 +300,114 @@ def get_crops():
         region = request.args.get('region', '')
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 12))
+        # Keyset paging: pass cursor (empty for the first page) instead of page
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor, (int,))[0] if cursor else None
         
-        query = supabase.table('crops').select('*')
-        
-        if search:
-            query = query.ilike('name', f'%{search}%')
-        if crop_type:
-            query = query.eq('type', crop_type)
-        if region:
-            query = query.eq('region', region)
-        
-        # Add pagination
-        query = query.range((page-1)*per_page, page*per_page-1)
+        # ilike is case-insensitive, so searches differing only in case share an entry
+        cache_key = (search.lower(), crop_type, region, page, per_page, cursor)
+        cached = crop_cache.get(cache_key)
+        if cached is None:
+            generation = crop_cache.generation
+            if CROP_SEARCH_INDEX:
+                # Filtered on the catalog snapshot's arrays; the version check keeps it current
+                catalog = recommender.get(supabase)[1]
+                if cursor is None:
+                    data, total = catalog.search(search, crop_type, region, (page-1)*per_page, per_page)
+                    next_cursor = None
+                else:
+                    data, total = catalog.search(search, crop_type, region, limit=per_page + 1, after=after or 0)
+                    data, next_cursor = split_page(data, per_page, lambda crop: [crop['id']])
+            else:
+                query = filter_crops(supabase.table('crops').select('*'), search, crop_type, region)
+                
+                if cursor is None:
+                    # Add pagination
+                    query = query.range((page-1)*per_page, page*per_page-1)
+                else:
+                    if after is not None:
+                        query = query.gt('id', after)
+                    query = query.order('id').limit(per_page + 1)
+                # The page and its total are fetched concurrently
+                result, total = db.gather(query, lambda: count_crops(search, crop_type, region))
+                data = result.data
+                next_cursor = None
+                if cursor is not None:
+                    data, next_cursor = split_page(data, per_page, lambda crop: [crop['id']])
+            # Rows are encoded once here rather than on every cache hit
+            cached = (encode_rows(data), next_cursor, total)
+            crop_cache.set(cache_key, cached, tags=[crop['id'] for crop in data], generation=generation)
+        data, next_cursor, total = cached
         
-        crops = query.execute()
-        return jsonify({
+        return json_response({
             'success': True,
-            'data': crops.data,
+            'data': data,
             'page': page,
             'per_page': per_page,
-            'total': len(crops.data)
+            'total': total,
+            'next_cursor': next_cursor
         })
+    except InvalidCursor as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.route('/api/crops/cache', methods=['GET'])
+def crop_cache_stats():
+    return jsonify({
+        'success': True,
+        'cache': crop_cache.stats()
+    })
+
+@app.route('/api/market/prices', methods=['GET'])
+def market_prices():
+    """Price and trade stats per crop type, region and day from the running totals"""
+    try:
+        crop_type = request.args.get('type') or None
+        region = request.args.get('region') or None
+        days = int(request.args.get('days', MARKET_DAYS))
+        since = window_start(days)
+        daily = supabase.rpc('market_summary', {
+            'p_since': since.isoformat(), 'p_type': crop_type, 'p_region': region
+        }).execute().data
+        daily, summary = market_report(daily)
+        return jsonify({
+            'success': True,
+            'since': since.isoformat(),
+            'days': days,
+            'daily': daily,
+            'summary': summary
+        })
+    except ValueError as e:  # days isn't a number or is out of range
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/recommendations/cache', methods=['GET'])
+def recommendation_cache_stats():
+    return jsonify({
+        'success': True,
+        'cache': {**recommendation_cache.stats(), 'coalesced': recommendation_flights.coalesced}
+    })
+
 @app.route('/api/recommendations', methods=['POST'])
 def recommendations():
     try:
         cart_items = request.json.get('cart', [])
         recommendations = get_ai_recommendations(cart_items, supabase)
-        return jsonify({
+        return json_response({
             'success': True,
             'recommendations': recommendations,
             'message': 'AI recommendations generated based on your cart items'
@@ -186,22 +460,33 @@ def create_order():
             'payment_status': 'pending'
         }
         
-        # Insert into Supabase
-        supabase.table('orders').insert(order_record).execute()
+        order_items = [{
+            'crop_id': item['id'],
+            'quantity': item['quantity'],
+            'unit_price': item['price'],
+            'total_price': item['price'] * item['quantity']
+        } for item in items]
         
-        # Create order items and update crop quantities
-        for item in items:
-            order_item = {
-                'order_id': order_id,
-                'crop_id': item['id'],
-                'quantity': item['quantity'],
-                'unit_price': item['price'],
-                'total_price': item['price'] * item['quantity']
-            }
-            supabase.table('order_items').insert(order_item).execute()
-            
-            # Update crop quantity in inventory
-            supabase.table('crops').update({'quantity': item['remaining_quantity']}).eq('id', item['id']).execute()
+        # Order, items and stock decrements commit together in one round trip;
+        # orders exceeding the stock are rejected (InsufficientStock) either way
+        reservation = inventory.reserve(order_items) if inventory else None
+        try:
+            updated_crops = order_store.create(order_record, order_items, reserved=reservation is not None)
+        except Exception:
+            if reservation is not None:
+                inventory.release(reservation)
+            raise
+        finally:
+            order_totals.invalidate_tags([str(user_id)])
+            # Cached pages showing these crops now have stale stock
+            crop_cache.invalidate_tags([item['id'] for item in items])
+        catalog = recommender.snapshot[1]
+        for crop in updated_crops:
+            catalog.patch(crop['id'], {'quantity': crop['quantity']})
+        # Again after the patch, so a page or recommendation read from the
+        # unpatched catalog in between isn't kept
+        crop_cache.invalidate_tags([item['id'] for item in items])
+        recommendation_cache.invalidate_tags([item['id'] for item in items])
         
         # Process payment if not cash on delivery
         if payment_method != 'cash_on_delivery':
@@ -213,9 +498,18 @@ def create_order():
                 }), 400
             else:
                 supabase.table('orders').update({'payment_status': 'completed'}).eq('id', order_id).execute()
+                # The prerendered invoice and the email show the stored status
+                order_record['payment_status'] = 'completed'
+        
+        invoice_items = [
+            {**order_item, 'crops': {'name': item['name']}}
+            for order_item, item in zip(order_items, items)
+        ]
+        if INVOICE_PRERENDER:
+            invoice_renderer.submit(render_invoice, order_record, invoice_items)
         
-        # Send confirmation email
-        send_order_confirmation(order_record, items)
+        # Queue confirmation email; delivery happens after the response
+        send_order_confirmation(order_record, invoice_items)
         
         return jsonify({
             'success': True,
@@ -223,6 +517,11 @@ def create_order():
             'message': 'Order created successfully'
         })
         
+    except InsufficientStock as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
     except Exception as e:
         return jsonify({
             'success': False,
@@ -234,27 +533,58 @@ def get_user_orders(user_id):
     try:
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
+        # Keyset paging on (order_date, id): pass cursor (empty for the first page) instead of page
+        cursor = request.args.get('cursor')
         
-        # Get orders with pagination
-        orders = supabase.table('orders').select('*').eq('user_id', user_id
+        # Items are embedded in the same request, or batch loaded below (attach_items)
+        query = supabase.table('orders').select(order_store.order_columns).eq('user_id', user_id
             ).order('order_date', desc=True
-            ).range((page-1)*per_page, page*per_page-1).execute().data
+            ).order('id', desc=True)
         
-        # Get order items for each order
-        for order in orders:
-            items = supabase.table('order_items').select('*, crops(name, type, region)').eq('order_id', order['id']).execute().data
-            order['items'] = items
+        if cursor is None:
+            # Get orders with pagination
+            query = query.range((page-1)*per_page, page*per_page-1)
+        else:
+            if cursor:
+                order_date, last_id = decode_cursor(cursor, (str, str))
+                query = query.or_(
+                    f'order_date.lt.{quote(order_date)},'
+                    f'and(order_date.eq.{quote(order_date)},id.lt.{quote(last_id)})'
+                )
+            query = query.limit(per_page + 1)
         
-        # Get total count for pagination
-        count = supabase.table('orders').select('count', count='exact').eq('user_id', user_id).execute().count
+        # Total is cached per user and dropped when they place an order
+        count = order_totals.get(str(user_id))
+        count_query = None
+        if count is None:
+            generation = order_totals.generation
+            count_query = supabase.table('orders').select('id', count='exact').eq('user_id', user_id).limit(1)
         
-        return jsonify({
+        # The page and (on a cache miss) the total are fetched concurrently
+        result, counted = db.gather(query, count_query)
+        orders = result.data
+        next_cursor = None
+        if cursor is not None:
+            orders, next_cursor = split_page(orders, per_page, lambda order: [order['order_date'], order['id']])
+        if counted is not None:
+            count = counted.count
+            order_totals.set(str(user_id), count, tags=[str(user_id)], generation=generation)
+        
+        order_store.attach_items(orders)
+        
+        return json_response({
             'success': True,
             'data': orders,
             'page': page,
             'per_page': per_page,
-            'total': count
+            'total': count,
+            'next_cursor': next_cursor
         })
+    except InvalidCursor as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -264,24 +594,192 @@ def get_user_orders(user_id):
 @app.route('/api/orders/invoice/<order_id>', methods=['GET'])
 def generate_invoice(order_id):
     try:
-        # Get order data
-        order = supabase.table('orders').select('*').eq('id', order_id).execute().data
+        # Get the order and its items concurrently
+        order, items = db.gather(
+            supabase.table('orders').select('*').eq('id', order_id),
+            supabase.table('order_items').select('*, crops(name)').eq('order_id', order_id)
+        )
+        order = order.data
         if not order:
             return jsonify({'success': False, 'error': 'Order not found'}), 404
         
         order = order[0]
-        items = supabase.table('order_items').select('*, crops(name)').eq('order_id', order_id).execute().data
+        items = items.data
+        
+        # The client already has this exact invoice
+        etag = invoice_etag(order, items)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
         
-        # Create PDF invoice
-        pdf_file = create_invoice_pdf(order, items)
+        pdf = render_invoice(order, items, etag)
         
-        return send_file(
-            pdf_file,
+        response = send_file(
+            io.BytesIO(pdf),
             as_attachment=True,
             download_name=f'invoice_{order_id}.pdf',
-            mimetype='application/pdf'
+            mimetype='application/pdf',
+            etag=etag,
+            max_age=0
+        )
+        response.cache_control.private = True
+        return response
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def get_invoice_pool():
+    global invoice_pool
+    if invoice_pool is None:
+        # Forking a threaded server can copy a lock some other thread holds; start clean processes instead
+        invoice_pool = ProcessPoolExecutor(max_workers=INVOICE_EXPORT_WORKERS,
+                                           mp_context=multiprocessing.get_context('forkserver'))
+    return invoice_pool
+
+def iter_export_orders(order_ids=None, start_date=None, end_date=None, user_id=None, batch_size=200):
+    """Yield orders (with their items) for an export, fetching batch_size at a time"""
+    if order_ids:
+        for start in range(0, len(order_ids), batch_size):
+            query = supabase.table('orders').select(order_store.order_columns
+                ).in_('id', order_ids[start:start + batch_size])
+            if user_id:
+                query = query.eq('user_id', user_id)
+            yield from order_store.attach_items(query.execute().data)
+        return
+    
+    # Date ranges are walked with keyset reads on (order_date, id)
+    last = None
+    while True:
+        query = supabase.table('orders').select(order_store.order_columns
+            ).gte('order_date', start_date).lt('order_date', end_date)
+        if user_id:
+            query = query.eq('user_id', user_id)
+        if last:
+            query = query.or_(
+                f'order_date.gt.{quote(last[0])},'
+                f'and(order_date.eq.{quote(last[0])},id.gt.{quote(last[1])})'
+            )
+        orders = query.order('order_date').order('id').limit(batch_size).execute().data
+        yield from order_store.attach_items(orders)
+        if len(orders) < batch_size:
+            return
+        last = (orders[-1]['order_date'], orders[-1]['id'])
+
+def render_invoices(orders, window):
+    """Yield (order_id, pdf) as renders finish, keeping at most `window` in flight"""
+    pool = get_invoice_pool()
+    pending = {}
+    
+    def finished(futures):
+        for future in futures:
+            order_id, etag = pending.pop(future)
+            pdf = future.result()
+            invoice_cache.set(etag, pdf)
+            yield order_id, pdf
+    
+    for order in orders:
+        items = order.pop('items')
+        etag = invoice_etag(order, items)
+        pdf = invoice_cache.get(etag)
+        if pdf is not None:
+            yield order['id'], pdf
+            continue
+        pending[pool.submit(create_invoice_pdf, order, items)] = (order['id'], etag)
+        if len(pending) >= window:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        yield from finished(done)
+
+@app.route('/api/orders/invoices/export', methods=['POST'])
+def export_invoices():
+    """Stream a ZIP of invoices for a list of order ids or an order_date range.
+
+    Without the admin token only one user's orders are exported: user_id is
+    required and orders of other users are left out.
+    """
+    try:
+        body = request.json or {}
+        order_ids = body.get('order_ids') or []
+        start_date = body.get('start_date')
+        end_date = body.get('end_date')
+        user_id = body.get('user_id')
+        if not user_id and not is_admin():
+            return jsonify({
+                'success': False,
+                'error': 'Provide user_id or an admin token'
+            }), 403
+        if not order_ids and not (start_date and end_date):
+            return jsonify({
+                'success': False,
+                'error': 'Provide order_ids or start_date and end_date'
+            }), 400
+        
+        orders = iter_export_orders(order_ids, start_date, end_date, user_id)
+        files = (
+            (f'invoice_{order_id}.pdf', pdf)
+            for order_id, pdf in render_invoices(orders, window=2 * INVOICE_EXPORT_WORKERS)
+        )
+        return Response(
+            stream_with_context(stream_zip(files)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=invoices.zip'}
         )
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/export/<table>', methods=['GET'])
+def export_table(table):
+    """Stream a whole table as NDJSON (default) or CSV, optionally gzipped.
+
+    Rows come in id order. After a dropped connection, pass the id of the
+    last complete row as ?after= to continue where the download stopped. If
+    reading fails part way, the body ends with an error marker instead (see
+    export_stream.py). Admin only.
+    """
+    try:
+        if not is_admin():
+            return jsonify({
+                'success': False,
+                'error': 'Admin token required'
+            }), 403
+        if table not in EXPORT_TABLES:
+            return jsonify({
+                'success': False,
+                'error': f"Unknown table '{table}'; choose from {', '.join(EXPORT_TABLES)}"
+            }), 404
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in ('ndjson', 'csv'):
+            return jsonify({
+                'success': False,
+                'error': 'format must be ndjson or csv'
+            }), 400
+        after = request.args.get('after')
+        try:
+            after = parse_after(table, after) if after else None
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f'Invalid after: {str(e)}'
+            }), 400
+        compress = request.args.get('gzip') == '1'
+        batch_size = max(1, min(int(request.args.get('batch_size', EXPORT_BATCH_SIZE)), 10000))
         
+        filename = f'{table}.{fmt}' + ('.gz' if compress else '')
+        mimetype = 'application/gzip' if compress else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+        return Response(
+            stream_with_context(export_stream(supabase, table, fmt, after, compress, batch_size)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
     except Exception as e:
         return jsonify({
             'success': False,
@@ -313,7 +811,7 @@ def process_payment(order_id, amount, method):
         }
 
 def send_order_confirmation(order, items):
-    """Send order confirmation email"""
+    """Queue order confirmation email"""
     if not EMAIL_USER or not EMAIL_PASS:
         print("Email not configured - skipping email sending")
         return
@@ -398,20 +896,46 @@ def send_order_confirmation(order, items):
     
     msg.attach(MIMEText(email_body, 'html'))
     
-    try:
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASS)
-            server.send_message(msg)
-    except Exception as e:
-        print(f"Failed to send email: {str(e)}")
+    email_queue.enqueue(msg)
+
+def invoice_etag(order, items):
+    """Hash of the order and item fields printed on the invoice"""
+    # Numbers go through float() so 2, 2.0 and DECIMAL values hash alike
+    content = {
+        'order': {key: order.get(key) for key in (
+            'id', 'order_date', 'status', 'shipping_name', 'shipping_email', 'shipping_phone',
+            'shipping_address', 'shipping_region', 'payment_method', 'payment_status'
+        )},
+        'total_amount': float(order['total_amount']),
+        'items': [
+            [item['crops']['name'], float(item['quantity']), float(item['unit_price']), float(item['total_price'])]
+            for item in items
+        ]
+    }
+    raw = json.dumps(content, sort_keys=True, default=str).encode()
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+def render_invoice(order, items, etag=None):
+    """Return the invoice PDF bytes, rendering only on a cache miss"""
+    etag = etag or invoice_etag(order, items)
+    pdf = invoice_cache.get(etag)
+    if pdf is None:
+        with timed('pdf'):
+            pdf = create_invoice_pdf(order, items)
+        invoice_cache.set(etag, pdf)
+    return pdf
 
 def create_invoice_pdf(order, items):
-    """Generate PDF invoice using ReportLab"""
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    filename = temp_file.name
+    """Generate PDF invoice using ReportLab, returned as bytes"""
+    # Imported on first use so routes without invoices start faster
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    
+    buffer = io.BytesIO()
     
-    doc = SimpleDocTemplate(filename, pagesize=letter)
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
     styles = getSampleStyleSheet()
     
     # Custom styles
@@ -486,7 +1010,25 @@ def create_invoice_pdf(order, items):
     
     # Build PDF
     doc.build(elements)
-    return filename
+    return buffer.getvalue()
+
+def warm_up(client=None):
+    """Load the model, catalog and lazily imported libraries ahead of the first request.
+
+    Called in the gunicorn master when preloading (see gunicorn.conf.py) so
+    forked workers share it. A separate client is used and closed again, so
+    no open connection is inherited by the workers.
+    """
+    own_client = client is None
+    if own_client:
+        client = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'),
+                               options=ClientOptions(postgrest_client_timeout=DB_TIMEOUT))
+    try:
+        recommender.get(client)
+    finally:
+        if own_client:
+            client.postgrest.session.close()
+    import reportlab.platypus  # noqa: F401  (used by create_invoice_pdf)
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
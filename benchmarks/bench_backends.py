@@ -0,0 +1,96 @@
+"""Compare recommender backends on synthetic catalogs.
+
+    python -m benchmarks.bench_backends --sizes 10000 100000 1000000
+
+Reports build time, single-cart query latency, index memory and recall@k
+against an exact brute-force search over the same feature space.
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+# ai_service connects a client at import; the benchmark never talks to it
+os.environ.setdefault('SUPABASE_URL', 'http://localhost')
+os.environ.setdefault('SUPABASE_KEY', 'benchmark')
+
+from ai_service import extract_features  # noqa: E402
+from benchmarks.synthetic import synthetic_crops  # noqa: E402
+from neighbor_table import normalize, top_k  # noqa: E402
+from recommender_backends import BACKENDS, make_backend  # noqa: E402
+
+
+def exact_neighbors(backend, X, queries, k, block=64):
+    """Ground truth: brute force in the backend's own feature space"""
+    if hasattr(backend, 'prepare'):
+        vectors, targets = backend.prepare(X), backend.prepare(queries)
+    else:
+        vectors, targets = normalize(X), normalize(queries)
+    indices = []
+    for start in range(0, len(targets), block):
+        cols, _ = top_k(targets[start:start + block] @ vectors.T, k)
+        indices.append(cols)
+    return np.vstack(indices)
+
+
+def bench(name, X, queries, k):
+    tracemalloc.start()
+    started = time.perf_counter()
+    backend = make_backend(name, n_neighbors=k).fit(X)
+    build_seconds = time.perf_counter() - started
+    index_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    found = []
+    for query in queries:
+        started = time.perf_counter()
+        _, indices = backend.query(query[None, :], k)
+        latencies.append(time.perf_counter() - started)
+        found.append(indices[0])
+    truth = exact_neighbors(backend, X, queries, k)
+    recall = np.mean([len(np.intersect1d(f, t)) / k for f, t in zip(found, truth)])
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'backend': name,
+        'catalog_size': len(X),
+        'build_s': round(build_seconds, 3),
+        'query_p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'query_p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        # Brute force keeps a reference to X rather than a copy
+        'features_mb': round(X.nbytes / 2 ** 20, 2),
+        'index_mb': round(index_bytes / 2 ** 20, 2),
+        'build_peak_mb': round(peak_bytes / 2 ** 20, 2),
+        f'recall@{k}': round(float(recall), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--json', help='Also write results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        X = extract_features(synthetic_crops(size))
+        queries = extract_features(synthetic_crops(args.queries, seed=1))
+        for name in args.backends:
+            result = bench(name, X, queries, args.k)
+            results.append(result)
+            print('  '.join(f'{key}={value}' for key, value in result.items()), flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Co-purchase mining throughput and peak memory over millions of order lines.
+
+    python -m benchmarks.bench_copurchase --lines 5000000 --crops 5000
+
+Feeds synthetic order lines to CoPurchaseIndex.add_baskets() one chunk at
+a time, the way update() does with pages of order_items, and reports lines
+per second and peak memory. Peak memory should follow the chunk size and
+the number of crop pairs, not the number of lines.
+"""
+import argparse
+import json
+import resource
+import time
+
+import numpy as np
+
+from copurchase import COPURCHASE_CHUNK, CoPurchaseIndex
+
+
+def chunks(lines, crops, chunk_size, max_items, seed=0):
+    """Yield (order_ids, crop_ids) arrays; popular crops are bought more often"""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, crops + 1)
+    weights /= weights.sum()
+    next_order = 0
+    for start in range(0, lines, chunk_size):
+        size = min(chunk_size, lines - start)
+        basket_sizes = rng.integers(1, max_items + 1, size=size)
+        order_ids = np.repeat(np.arange(next_order, next_order + size), basket_sizes)[:size]
+        next_order = int(order_ids[-1]) + 1
+        yield order_ids, rng.choice(np.arange(1, crops + 1), size=size, p=weights)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=2000000)
+    parser.add_argument('--crops', type=int, default=2000)
+    parser.add_argument('--chunk', type=int, default=COPURCHASE_CHUNK)
+    parser.add_argument('--max-items', type=int, default=8)
+    parser.add_argument('--json', help='Also write results to this file')
+    args = parser.parse_args()
+
+    index = CoPurchaseIndex()
+    orders = 0
+    started = time.perf_counter()
+    for order_ids, crop_ids in chunks(args.lines, args.crops, args.chunk, args.max_items):
+        orders += index.add_baskets(order_ids, crop_ids)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        'lines': args.lines,
+        'orders': orders,
+        'crops': args.crops,
+        'chunk': args.chunk,
+        'pairs': len(index),
+        'seconds': round(elapsed, 2),
+        'lines_per_second': round(args.lines / elapsed),
+        'matrix_mb': round((index.counts.data.nbytes + index.counts.indices.nbytes
+                            + index.counts.indptr.nbytes) / 2**20, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    print('  '.join(f'{key}={value}' for key, value in result.items()))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Per-worker throughput with and without concurrent Supabase queries.
+
+    python -m benchmarks.bench_data_layer --latency 0.02 --duration 5
+
+Serves requests one at a time on a single thread (one sync worker) against
+a fake Supabase that sleeps for each round trip, once with queries issued
+sequentially (pool size 0) and once through the QueryPool.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+# ai_service connects a client at import; the benchmark swaps in a fake
+os.environ.setdefault('SUPABASE_URL', 'http://localhost')
+os.environ.setdefault('SUPABASE_KEY', 'benchmark')
+
+import ai_service  # noqa: E402
+from benchmarks.fake_supabase import FakeSupabase  # noqa: E402
+from benchmarks.synthetic import synthetic_crops, synthetic_orders  # noqa: E402
+from data_layer import QueryPool  # noqa: E402
+
+
+def endpoints(orders, users):
+    order_ids = [order['id'] for order in orders]
+    return {
+        'crops': lambda i: f'/api/crops?page={i % 20 + 1}&search=dhan',
+        'orders': lambda i: f'/api/orders/{i % users + 1}?page={i % 3 + 1}',
+        'invoice': lambda i: f'/api/orders/invoice/{order_ids[i % len(order_ids)]}',
+    }
+
+
+def run(client, path_for, duration):
+    served = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        response = client.get(path_for(served))
+        assert response.status_code == 200, response.get_data(as_text=True)
+        served += 1
+    return served / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per Supabase round trip')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per measurement')
+    parser.add_argument('--crops', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--json', help='Also write results to this file')
+    args = parser.parse_args()
+
+    crops = synthetic_crops(args.crops)
+    orders, items = synthetic_orders(crops, users=args.users)
+    fake = FakeSupabase({'crops': crops, 'orders': orders, 'order_items': items}, latency=args.latency)
+    ai_service.supabase = fake
+    ai_service.order_store.client = fake
+    # With CROP_SEARCH_INDEX the crops endpoint builds the recommender; keep its files out of the tree
+    scratch = tempfile.mkdtemp()
+    ai_service.recommender.model_path = os.path.join(scratch, 'crop_model.joblib')
+    ai_service.recommender.snapshot_dir = os.path.join(scratch, 'catalog_snapshots')
+    # Measure the queries, not the caches in front of them
+    ai_service.crop_cache.maxsize = 0
+    ai_service.order_totals.maxsize = 0
+    ai_service.crop_totals.maxsize = 0
+    ai_service.invoice_cache.maxsize = 0
+    client = ai_service.app.test_client()
+
+    results = []
+    for name, path_for in endpoints(orders, args.users).items():
+        result = {'endpoint': name, 'latency_ms': args.latency * 1000}
+        for label, pool_size in (('sequential', 0), ('concurrent', args.pool_size)):
+            ai_service.db = QueryPool(pool_size)
+            result[f'{label}_rps'] = round(run(client, path_for, args.duration), 2)
+            ai_service.db.shutdown()
+        result['speedup'] = round(result['concurrent_rps'] / result['sequential_rps'], 2)
+        results.append(result)
+        print('  '.join(f'{key}={value}' for key, value in result.items()), flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""Flash-sale checkout simulation: no overselling, and how often stock rows are written.
+
+    python -m benchmarks.bench_inventory --stock 1000 --checkouts 2000 --threads 64
+    python -m benchmarks.bench_inventory --dsn postgresql://localhost/krishighor
+
+Many threads buy the same hot crop at once. 'direct' writes every order with
+create_order(), which locks and decrements the crop row per order; 'engine'
+reserves through InventoryEngine, one per simulated worker process, all
+sharing the same database. Runs against the in-memory fake unless --dsn
+points at a Postgres database loaded with init_db.sql. The run fails if any
+stock is oversold or lost, or if an order is rejected while the stock it
+asked for is still there (held unsold by some worker, say).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+
+from benchmarks.fake_supabase import FakeSupabase
+from benchmarks.synthetic import synthetic_crops
+from inventory import InventoryEngine
+from order_store import InsufficientStock, PostgresOrderStore, SupabaseOrderStore
+
+
+class CountingStore:
+    """Wraps an order store to count the calls that write crop stock"""
+
+    def __init__(self, store):
+        self.store = store
+        self.stock_writes = 0
+        self._lock = threading.Lock()
+
+    def _count(self):
+        with self._lock:
+            self.stock_writes += 1
+
+    def create(self, order, items, reserved=False):
+        if not reserved:
+            self._count()
+        return self.store.create(order, items, reserved)
+
+    def lease_stock(self, quantities, extra=None, share=1):
+        self._count()
+        return self.store.lease_stock(quantities, extra, share)
+
+    def return_stock(self, quantities):
+        self._count()
+        return self.store.return_stock(quantities)
+
+    def wanted_stock(self, crop_ids):
+        return self.store.wanted_stock(crop_ids)
+
+
+def make_store(args, stock):
+    """Return (store, read_quantity) with the hot crop (id 1) holding `stock`"""
+    if args.dsn:
+        store = PostgresOrderStore(args.dsn)
+        with store.connection() as conn, conn, conn.cursor() as cur:
+            cur.execute('SELECT id FROM crops ORDER BY id LIMIT 1')
+            crop_id = cur.fetchone()[0]
+            cur.execute('UPDATE crops SET quantity = %s WHERE id = %s', (stock, crop_id))
+            cur.execute('DELETE FROM stock_leases WHERE crop_id = %s', (crop_id,))
+            cur.execute('SELECT id FROM users ORDER BY id LIMIT 1')
+            user_id = cur.fetchone()[0]
+
+        def read_quantity():
+            with store.connection() as conn, conn, conn.cursor() as cur:
+                cur.execute('SELECT quantity FROM crops WHERE id = %s', (crop_id,))
+                return Decimal(cur.fetchone()[0])
+        return store, crop_id, user_id, read_quantity
+
+    crops = synthetic_crops(10)
+    crops[0].update({'name': 'Fazli Mango', 'type': 'Fruit', 'quantity': float(stock)})
+    fake = FakeSupabase({'crops': crops, 'orders': [], 'order_items': []}, latency=args.latency)
+    return SupabaseOrderStore(fake), crops[0]['id'], 1, lambda: Decimal(str(crops[0]['quantity']))
+
+
+def run(args, mode):
+    store, crop_id, user_id, read_quantity = make_store(args, args.stock)
+    counting = CountingStore(store)
+    engines = [InventoryEngine(counting, lease_size=args.lease_size, idle_return=0) for _ in range(args.workers)]
+    rng = random.Random(args.seed)
+    wanted = [rng.randint(1, 5) for _ in range(args.checkouts)]
+    sold = []
+    rejected = []
+    lock = threading.Lock()
+
+    def checkout(i):
+        items = [{'crop_id': crop_id, 'quantity': wanted[i], 'unit_price': 80.0, 'total_price': 80.0 * wanted[i]}]
+        order = {
+            'id': str(uuid.uuid4()), 'user_id': user_id, 'order_date': datetime.now().isoformat(),
+            'total_amount': 80.0 * wanted[i], 'status': 'pending', 'payment_method': 'bkash',
+            'payment_status': 'pending', 'shipping_address': 'Rajshahi', 'shipping_region': 'Rajshahi',
+            'shipping_phone': '01700000000', 'shipping_email': 'buyer@example.com',
+        }
+        engine = engines[i % len(engines)] if mode == 'engine' else None
+        try:
+            reservation = engine.reserve(items) if engine else None
+            try:
+                counting.create(order, items, reserved=reservation is not None)
+            except Exception:
+                if reservation is not None:
+                    engine.release(reservation)
+                raise
+        except InsufficientStock:
+            with lock:
+                rejected.append(wanted[i])
+            return
+        with lock:
+            sold.append(wanted[i])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(checkout, range(args.checkouts)))
+    elapsed = time.perf_counter() - started
+    for engine in engines:
+        engine.close()
+
+    remaining = read_quantity()
+    result = {
+        'mode': mode,
+        'workers': args.workers if mode == 'engine' else None,
+        'checkouts': args.checkouts,
+        'accepted': len(sold),
+        'rejected': len(rejected),
+        'units_sold': sum(sold),
+        'stock_left': float(remaining),
+        'stock_writes': counting.stock_writes,
+        'checkouts_per_s': round(args.checkouts / elapsed, 1),
+    }
+    # Every unit is either sold or still in the database, and nothing went negative
+    assert remaining >= 0, result
+    assert Decimal(sum(sold)) + remaining == args.stock, result
+    # Stock only goes down, so an order rejected for lack of stock asked for
+    # more than is left at the end
+    assert not rejected or min(rejected) > remaining, result
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stock', type=int, default=1000)
+    parser.add_argument('--checkouts', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=4, help='Simulated processes, each with its own engine')
+    parser.add_argument('--lease-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.005, help='Fake round trip in seconds (ignored with --dsn)')
+    parser.add_argument('--dsn', help='Postgres database with init_db.sql loaded')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Also write results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for mode in ('direct', 'engine'):
+        result = run(args, mode)
+        results.append(result)
+        print('  '.join(f'{key}={value}' for key, value in result.items()), flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Cold start time and per-worker memory, with and without pre-fork warm-up.
+
+    python -m benchmarks.bench_startup --workers 4
+
+Each measurement runs in a fresh interpreter against the in-memory Supabase
+fake. 'cold' imports ai_service and times the first request of each route.
+The worker modes mimic gunicorn: 'preload' imports and warms the app once and
+then forks (GUNICORN_PRELOAD=1); 'no-preload' forks first and lets every worker
+load for itself. Worker memory is read from /proc (Linux) after each worker
+has served a recommendation and an invoice.
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_MODULES = ['numpy', 'sklearn', 'joblib', 'reportlab']
+
+
+def memory_kb():
+    """(rss, pss, uss) of this process in kB from /proc/self/smaps_rollup"""
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return values['Rss'], values['Pss'], values['Private_Clean'] + values['Private_Dirty']
+
+
+def setup(latency, model_path, snapshot_dir):
+    os.environ.setdefault('SUPABASE_URL', 'http://localhost')
+    os.environ.setdefault('SUPABASE_KEY', 'benchmark')
+    started = time.perf_counter()
+    import ai_service
+    import_seconds = time.perf_counter() - started
+    from benchmarks.fake_supabase import FakeSupabase
+    from benchmarks.synthetic import synthetic_carts, synthetic_crops, synthetic_orders
+
+    crops = synthetic_crops(5000)
+    orders, items = synthetic_orders(crops, users=20, orders_per_user=5)
+    fake = FakeSupabase({'crops': crops, 'orders': orders, 'order_items': items}, latency=latency)
+    ai_service.supabase = fake
+    ai_service.order_store = ai_service.make_order_store(fake, 'supabase')
+    ai_service.recommender.model_path = model_path
+    ai_service.recommender.snapshot_dir = snapshot_dir
+    requests = {
+        'get_crops': ('GET', '/api/crops?page=1', None),
+        'recommendations': ('POST', '/api/recommendations', {'cart': synthetic_carts(crops, 1)[0]}),
+        'generate_invoice': ('GET', f"/api/orders/invoice/{orders[0]['id']}", None),
+    }
+    return ai_service, fake, requests, import_seconds
+
+
+def serve(ai_service, requests, names):
+    client = ai_service.app.test_client()
+    timings = {}
+    for name in names:
+        method, path, body = requests[name]
+        started = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    return timings
+
+
+def cold(args):
+    ai_service, _, requests, import_seconds = setup(args.latency, args.model_path, args.snapshot_dir)
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    rss_kb = memory_kb()[0]
+    return {
+        'mode': 'cold',
+        'import_ms': round(import_seconds * 1000, 1),
+        'rss_after_import_mb': round(rss_kb / 1024, 1),
+        'heavy_modules_at_import': loaded,
+        'first_request_ms': serve(ai_service, requests, ['get_crops', 'recommendations', 'generate_invoice']),
+    }
+
+
+def workers(args, preload):
+    if preload:
+        started = time.perf_counter()
+        ai_service, fake, requests, _ = setup(args.latency, args.model_path, args.snapshot_dir)
+        ai_service.warm_up(fake)
+        gc.freeze()
+        master_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    reports = []
+    children = []
+    for _ in range(args.workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            started = time.perf_counter()
+            if not preload:
+                ai_service, fake, requests, _ = setup(args.latency, args.model_path, args.snapshot_dir)
+            timings = serve(ai_service, requests, ['recommendations', 'generate_invoice'])
+            ready_ms = round((time.perf_counter() - started) * 1000, 1)
+            time.sleep(0.5)  # Let siblings finish so shared pages are counted across all of them
+            rss, pss, uss = memory_kb()
+            with os.fdopen(write_fd, 'w') as f:
+                json.dump({'ready_ms': ready_ms, 'first_request_ms': timings, 'rss_kb': rss, 'pss_kb': pss,
+                           'uss_kb': uss}, f)
+            os._exit(0)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+    for pid, read_fd in children:
+        with os.fdopen(read_fd) as f:
+            reports.append(json.load(f))
+        os.waitpid(pid, 0)
+
+    mean = lambda key: round(sum(report[key] for report in reports) / len(reports) / 1024, 1)
+    result = {
+        'mode': 'preload' if preload else 'no-preload',
+        'workers': args.workers,
+        'worker_ready_ms': max(report['ready_ms'] for report in reports),
+        'worker_rss_mb': mean('rss_kb'),
+        'worker_pss_mb': mean('pss_kb'),
+        'worker_uss_mb': mean('uss_kb'),
+    }
+    if preload:
+        result['master_warm_up_ms'] = master_ms
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per Supabase round trip')
+    parser.add_argument('--json', help='Also write results to this file')
+    parser.add_argument('--mode', choices=['cold', 'preload', 'no-preload'], help=argparse.SUPPRESS)
+    parser.add_argument('--model-path', help=argparse.SUPPRESS)
+    parser.add_argument('--snapshot-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Child interpreter: run one measurement and hand it back on stdout
+        result = cold(args) if args.mode == 'cold' else workers(args, args.mode == 'preload')
+        print(json.dumps(result))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('cold', 'no-preload', 'preload'):
+            # A fresh model file and snapshot directory per mode, so every mode starts by training
+            command = [sys.executable, '-m', 'benchmarks.bench_startup', '--mode', mode,
+                       '--workers', str(args.workers), '--latency', str(args.latency),
+                       '--model-path', os.path.join(tmp, f'{mode}.joblib'),
+                       '--snapshot-dir', os.path.join(tmp, f'{mode}-snapshots')]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            results.append(result)
+            print('  '.join(f'{key}={value}' for key, value in result.items()), flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""In-memory stand-in for the Supabase client with simulated network latency.
+
+Supports the subset of the PostgREST query builder the service uses, so
+handlers can be benchmarked without a database. Every execute() sleeps for
+the configured round-trip time, releasing the GIL like a real HTTP call.
+The create_order, lease_stock, return_stock and wanted_stock functions run
+on a MemoryOrderStore over the same tables; market_summary reads
+market_prices.
+"""
+import copy
+import re
+import threading
+import time
+from datetime import datetime
+
+from market import market_summary
+from order_store import MemoryOrderStore
+
+OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'neq': lambda a, b: a != b,
+    'gt': lambda a, b: a > b,
+    'gte': lambda a, b: a >= b,
+    'lt': lambda a, b: a < b,
+    'lte': lambda a, b: a <= b,
+}
+
+
+def coerce(actual, value):
+    """Cast a text filter value to the column's type, as Postgres does.
+
+    PostgREST sends every filter as text, so user_id '1' matches the integer 1.
+    """
+    if actual is not None and isinstance(value, str) and not isinstance(actual, str):
+        if isinstance(actual, bool):
+            return value.lower() in ('true', 't', '1')
+        try:
+            return type(actual)(value)
+        except (TypeError, ValueError):
+            pass
+    return value
+
+
+def split_top_level(expr):
+    """Split a PostgREST logic expression on commas outside () and quotes"""
+    parts, depth, quoted, current = [], 0, False, ''
+    for ch in expr:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        if ch == ',' and depth == 0 and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += ch
+    parts.append(current)
+    return parts
+
+
+def parse_condition(condition):
+    """Turn 'col.op.value', 'and(...)' or 'or(...)' into a row predicate"""
+    if condition.startswith('and('):
+        tests = [parse_condition(part) for part in split_top_level(condition[4:-1])]
+        return lambda row: all(test(row) for test in tests)
+    if condition.startswith('or('):
+        tests = [parse_condition(part) for part in split_top_level(condition[3:-1])]
+        return lambda row: any(test(row) for test in tests)
+    column, op, value = condition.split('.', 2)
+    if value.startswith('"'):
+        value = value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+
+    def test(row):
+        actual = row.get(column)
+        return OPERATORS[op](actual, coerce(actual, value))
+    return test
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.action = 'select'
+        self.payload = None
+        self.columns = '*'
+        self.count = None
+        self.filters = []
+        self.ordering = []
+        self.bounds = None
+        self.max_rows = None
+
+    def select(self, columns='*', count=None):
+        self.columns = columns
+        self.count = count
+        return self
+
+    def insert(self, rows):
+        self.action = 'insert'
+        self.payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, changes):
+        self.action = 'update'
+        self.payload = changes
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    def _filter(self, test):
+        self.filters.append(test)
+        return self
+
+    def eq(self, column, value):
+        return self._filter(lambda row: row.get(column) == coerce(row.get(column), value))
+
+    def neq(self, column, value):
+        return self._filter(lambda row: row.get(column) != coerce(row.get(column), value))
+
+    def gt(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) > coerce(row.get(column), value))
+
+    def gte(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) >= coerce(row.get(column), value))
+
+    def lt(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) < coerce(row.get(column), value))
+
+    def lte(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) <= coerce(row.get(column), value))
+
+    def in_(self, column, values):
+        values = set(values)
+        # Coercing is only needed when the values are text and the column isn't
+        coerced = {}
+
+        def test(row):
+            actual = row.get(column)
+            if actual in values:
+                return True
+            if actual is None or isinstance(actual, str):
+                return False
+            kind = type(actual)
+            if kind not in coerced:
+                coerced[kind] = {coerce(actual, value) for value in values}
+            return actual in coerced[kind]
+        return self._filter(test)
+
+    def ilike(self, column, pattern):
+        regex = re.compile('^' + re.escape(pattern).replace('%', '.*') + '$', re.IGNORECASE)
+        return self._filter(lambda row: bool(regex.match(str(row.get(column)))))
+
+    def or_(self, expr):
+        tests = [parse_condition(part) for part in split_top_level(expr)]
+        return self._filter(lambda row: any(test(row) for test in tests))
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def limit(self, n):
+        self.max_rows = n
+        return self
+
+    def _embed(self, rows):
+        tables = self.client.tables
+        crops = {crop['id']: crop for crop in tables.get('crops', [])}
+        if 'crops(' in self.columns:
+            for row in rows:
+                row['crops'] = copy.deepcopy(crops.get(row.get('crop_id')))
+        if 'order_items(' in self.columns:
+            alias = 'items' if 'items:order_items' in self.columns else 'order_items'
+            by_order = {}
+            for item in tables.get('order_items', []):
+                by_order.setdefault(item['order_id'], []).append(item)
+            for row in rows:
+                items = copy.deepcopy(by_order.get(row['id'], []))
+                for item in items:
+                    item['crops'] = copy.deepcopy(crops.get(item['crop_id']))
+                row[alias] = items
+        return rows
+
+    def _write(self, table):
+        if self.action == 'insert':
+            rows = []
+            for row in self.payload:
+                row = dict(row)
+                if 'id' not in row:
+                    row['id'] = max((existing['id'] for existing in table), default=0) + 1
+                table.append(row)
+                rows.append(row)
+            return FakeResponse(copy.deepcopy(rows))
+        matched = [row for row in table if all(test(row) for test in self.filters)]
+        if self.action == 'update':
+            for row in matched:
+                row.update(self.payload)
+                if self.table == 'crops':
+                    row['updated_at'] = datetime.now().isoformat()  # The crops_touch_updated_at trigger
+        else:
+            table[:] = [row for row in table if not any(row is match for match in matched)]
+        return FakeResponse(copy.deepcopy(matched))
+
+    def execute(self):
+        self.client.round_trip()
+        with self.client.lock:
+            if self.action != 'select':
+                return self._write(self.client.tables.setdefault(self.table, []))
+            rows = [row for row in self.client.tables.get(self.table, []) if all(test(row) for test in self.filters)]
+            for column, desc in reversed(self.ordering):
+                rows.sort(key=lambda row: row.get(column), reverse=desc)
+            total = len(rows)
+            if self.bounds:
+                rows = rows[self.bounds[0]:self.bounds[1] + 1]
+            if self.max_rows is not None:
+                rows = rows[:self.max_rows]
+            rows = self._embed(copy.deepcopy(rows))
+        return FakeResponse(rows, total if self.count else None)
+
+
+class FakeRPC:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def _call(self, store):
+        params = self.params
+        if self.name == 'create_order':
+            return store.create(params['p_order'], params['p_items'], params.get('p_reserved', False))
+        if self.name in ('lease_stock', 'return_stock'):
+            rows = params['p_requests'] if self.name == 'lease_stock' else params['p_returns']
+            quantities = {row['crop_id']: row['quantity'] for row in rows}
+            if self.name == 'return_stock':
+                return store.return_stock(quantities)
+            extra = {row['crop_id']: row.get('extra', 0) for row in rows}
+            granted = store.lease_stock(quantities, extra, params.get('p_share', 1))
+            return [{'id': crop_id, 'quantity': quantity, 'leased': leased}
+                    for crop_id, (quantity, leased) in granted.items()]
+        if self.name == 'wanted_stock':
+            return sorted(store.wanted_stock(params['p_crop_ids']))
+        if self.name == 'market_summary':
+            return market_summary(store.tables.get('market_prices', []), params['p_since'],
+                                  params.get('p_type'), params.get('p_region'))
+        raise ValueError(f"Unknown function '{self.name}'")
+
+    def _locked_crops(self):
+        """Crop rows the function locks until it commits, like FOR UPDATE does"""
+        params = self.params
+        if self.name == 'create_order' and not params.get('p_reserved', False):
+            return sorted({item['crop_id'] for item in params['p_items']})
+        if self.name in ('lease_stock', 'return_stock'):
+            return sorted({row['crop_id'] for row in params.get('p_requests', params.get('p_returns', []))})
+        return []
+
+    def execute(self):
+        locks = [self.client.row_lock('crops', crop_id) for crop_id in self._locked_crops()]
+        for lock in locks:
+            lock.acquire()
+        try:
+            self.client.round_trip()
+            with self.client.lock:
+                data = self._call(self.client.orders)
+        finally:
+            for lock in locks:
+                lock.release()
+        return FakeResponse(copy.deepcopy(data))
+
+
+class FakeSupabase:
+    """tables maps table names to lists of row dicts; latency is seconds per call"""
+
+    def __init__(self, tables=None, latency=0.02):
+        self.tables = tables if tables is not None else {}
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.orders = MemoryOrderStore(self.tables)
+        self._row_locks = {}
+
+    def row_lock(self, table, row_id):
+        with self.lock:
+            return self._row_locks.setdefault((table, row_id), threading.Lock())
+
+    def round_trip(self):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        return FakeRPC(self, name, params)
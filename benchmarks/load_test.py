@@ -0,0 +1,192 @@
+"""Load test the service's endpoints against an in-memory Supabase.
+
+    python -m benchmarks.load_test --latency 0.02 --concurrency 8 --json run.json
+    python -m benchmarks.load_test --json new.json --compare run.json
+
+Each endpoint is driven by --concurrency threads for --duration seconds
+through Flask's test client; no database, network or mail server is used.
+Reports p50/p95/p99 latency and throughput per endpoint.
+"""
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+# ai_service connects a client at import; the load test swaps in a fake
+os.environ.setdefault('SUPABASE_URL', 'http://localhost')
+os.environ.setdefault('SUPABASE_KEY', 'benchmark')
+
+import ai_service  # noqa: E402
+from benchmarks.fake_supabase import FakeSupabase  # noqa: E402
+from benchmarks.synthetic import REGIONS, synthetic_carts, synthetic_crops, synthetic_orders  # noqa: E402
+from market import backfill  # noqa: E402
+
+
+class NullSMTP:
+    """Accepts every message, so confirmations are built and queued but go nowhere"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def noop(self):
+        return (250, b'OK')
+
+    def send_message(self, msg):
+        pass
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def workload(crops, orders, users, seed=0):
+    """Map endpoint name -> function(i) returning (method, path, json body)"""
+    carts = synthetic_carts(crops, 500, seed=seed)
+    order_ids = [order['id'] for order in orders]
+    # Users who have orders, so every page has orders and items to return
+    user_ids = sorted({order['user_id'] for order in orders})
+    searches = ['', 'dhan', 'mango', 'bari']
+
+    def place_order(i):
+        cart = carts[i % len(carts)]
+        return 'POST', '/api/orders', {
+            'user_id': i % users + 1,
+            'items': [{key: item[key] for key in ('id', 'name', 'price')} | {'quantity': 1} for item in cart],
+            'shipping_info': {'address': 'House 1, Road 2', 'region': 'Dhaka', 'phone': '01700000000',
+                              'email': 'buyer@example.com'},
+            'payment_method': 'bkash',
+        }
+
+    return {
+        'get_crops': lambda i: ('GET', f'/api/crops?page={i % 10 + 1}&search={searches[i % len(searches)]}', None),
+        'recommendations': lambda i: ('POST', '/api/recommendations', {'cart': carts[i % len(carts)]}),
+        'create_order': place_order,
+        'get_user_orders': lambda i: ('GET', f'/api/orders/{user_ids[i % len(user_ids)]}?page={i % 3 + 1}', None),
+        'generate_invoice': lambda i: ('GET', f'/api/orders/invoice/{order_ids[i % len(order_ids)]}', None),
+        'market_prices': lambda i: ('GET', f'/api/market/prices?region={REGIONS[i % len(REGIONS)]}&days=90', None),
+    }
+
+
+def drive(client_factory, request_for, concurrency, duration):
+    """Send requests from `concurrency` threads; returns (latencies in s, errors, elapsed)"""
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        client = client_factory()
+        mine, failed = [], 0
+        while time.perf_counter() < deadline:
+            method, path, body = request_for(next(counter))
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            mine.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors), time.perf_counter() - started
+
+
+def summarize(name, latencies, errors, elapsed):
+    ms = np.array(latencies) * 1000
+    return {
+        'endpoint': name,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(float(np.percentile(ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(ms, 95)), 2),
+        'p99_ms': round(float(np.percentile(ms, 99)), 2),
+    }
+
+
+def compare(results, baseline_path):
+    """Print throughput and p95 changes against an earlier --json run"""
+    with open(baseline_path) as f:
+        baseline = {result['endpoint']: result for result in json.load(f)['results']}
+    for result in results:
+        before = baseline.get(result['endpoint'])
+        if before is None:
+            continue
+        rps = result['throughput_rps'] / before['throughput_rps'] - 1 if before['throughput_rps'] else 0.0
+        p95 = result['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+        print(f"endpoint={result['endpoint']}  throughput_change={rps:+.1%}  p95_change={p95:+.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--endpoints', nargs='+', help='Subset of endpoints to run (default: all)')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per Supabase round trip')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per endpoint')
+    parser.add_argument('--crops', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--orders-per-user', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--compare', help='Earlier --json file to compare against')
+    args = parser.parse_args()
+
+    crops = synthetic_crops(args.crops, seed=args.seed)
+    orders, items = synthetic_orders(crops, users=args.users, orders_per_user=args.orders_per_user, seed=args.seed)
+    fake = FakeSupabase({'crops': crops, 'orders': orders, 'order_items': items}, latency=args.latency)
+    backfill(fake.tables)
+    # Timed like the real client when METRICS / SERVER_TIMING are set
+    ai_service.supabase = ai_service.instrument_client(fake)
+    ai_service.order_store = ai_service.make_order_store(ai_service.supabase, 'supabase')
+    ai_service.EMAIL_USER = ai_service.EMAIL_USER or 'shop@example.com'
+    ai_service.EMAIL_PASS = ai_service.EMAIL_PASS or 'benchmark'
+    ai_service.email_queue.smtp_class = NullSMTP
+    # Keep the trained model and catalog snapshots out of the working tree
+    scratch = tempfile.mkdtemp()
+    ai_service.recommender.model_path = os.path.join(scratch, 'crop_model.joblib')
+    ai_service.recommender.snapshot_dir = os.path.join(scratch, 'catalog_snapshots')
+    ai_service.recommender.get(fake)
+
+    endpoints = workload(crops, orders, args.users, seed=args.seed)
+    names = args.endpoints or list(endpoints)
+    results = []
+    for name in names:
+        latencies, errors, elapsed = drive(ai_service.app.test_client, endpoints[name], args.concurrency, args.duration)
+        result = summarize(name, latencies, errors, elapsed)
+        results.append(result)
+        print('  '.join(f'{key}={value}' for key, value in result.items()), flush=True)
+    ai_service.email_queue.flush(timeout=30)
+
+    if args.compare:
+        compare(results, args.compare)
+    if args.json:
+        meta = {key: value for key, value in vars(args).items() if key not in ('json', 'compare')}
+        meta['timestamp'] = datetime.now().isoformat(timespec='seconds')
+        meta['supabase_calls'] = fake.calls
+        with open(args.json, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
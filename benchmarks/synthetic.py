@@ -0,0 +1,88 @@
+"""Synthetic catalog and order data shaped like the tables in init_db.sql"""
+import random
+import uuid
+from datetime import datetime, timedelta
+
+CROP_TYPES = ['Rice', 'Pulse', 'Vegetable', 'Nut', 'Fruit', 'Fiber', 'Oilseed']
+REGIONS = ['Barisal', 'Khulna', 'Rangpur', 'Dinajpur', 'Rajshahi', 'Faridpur', 'Bogra',
+           'Jessore', 'Pabna', 'Comilla', 'Sylhet', 'Dhaka', 'Chittagong', 'Mymensingh']
+NAME_PREFIXES = ['BRRI Dhan', 'BARI Mung', 'BARI Tomato', 'BINA Chinabadam', 'Fazli Mango',
+                 'Tossa Jute', 'BARI Alu', 'BARI Sarisha', 'BARI Piaz', 'BARI Misti Kodu',
+                 'BARI Strawberry', 'Langra Mango', 'BARI Begun', 'BINA Dhan']
+# Typical price band (taka per kg) for each type
+PRICE_RANGES = {
+    'Rice': (28, 60), 'Pulse': (90, 160), 'Vegetable': (15, 80), 'Nut': (200, 400),
+    'Fruit': (60, 300), 'Fiber': (40, 70), 'Oilseed': (55, 110),
+}
+
+
+def synthetic_crops(n, seed=0, start_id=1):
+    """Return n crop rows with realistic names, prices, stock and regions"""
+    rng = random.Random(seed)
+    base = datetime(2025, 1, 1)
+    crops = []
+    for i in range(n):
+        crop_type = rng.choice(CROP_TYPES)
+        low, high = PRICE_RANGES[crop_type]
+        crops.append({
+            'id': start_id + i,
+            'name': f'{rng.choice(NAME_PREFIXES)}-{rng.randint(1, 99)}',
+            'type': crop_type,
+            'quantity': float(rng.randint(100, 20000)),
+            'price': round(rng.uniform(low, high), 2),
+            'region': rng.choice(REGIONS),
+            'description': f'Synthetic {crop_type.lower()} lot',
+            'image_url': None,
+            'created_at': (base + timedelta(minutes=i)).isoformat(),
+            'updated_at': (base + timedelta(minutes=i)).isoformat(),
+        })
+    return crops
+
+
+def synthetic_orders(crops, users=100, orders_per_user=20, max_items=5, seed=0):
+    """Return (orders, order_items) rows for the given crops, like create_order writes them"""
+    rng = random.Random(seed)
+    base = datetime(2025, 1, 1)
+    orders, items = [], []
+    for user_id in range(1, users + 1):
+        for _ in range(orders_per_user):
+            order_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            order_date = (base + timedelta(minutes=rng.randint(0, 525600))).isoformat()
+            order_items = []
+            for crop in rng.sample(crops, rng.randint(1, min(max_items, len(crops)))):
+                quantity = float(rng.randint(1, 50))
+                order_items.append({
+                    'id': len(items) + len(order_items) + 1,
+                    'order_id': order_id,
+                    'crop_id': crop['id'],
+                    'quantity': quantity,
+                    'unit_price': crop['price'],
+                    'total_price': round(quantity * crop['price'], 2),
+                    'created_at': order_date,
+                })
+            items.extend(order_items)
+            orders.append({
+                'id': order_id,
+                'user_id': user_id,
+                'order_date': order_date,
+                'total_amount': round(sum(item['total_price'] for item in order_items), 2),
+                'status': 'pending',
+                'payment_method': rng.choice(['cash_on_delivery', 'bkash', 'nagad', 'card']),
+                'payment_status': 'pending',
+                'shipping_name': f'User {user_id}',
+                'shipping_address': f'House {user_id}, Road {rng.randint(1, 40)}',
+                'shipping_region': rng.choice(REGIONS),
+                'shipping_phone': f'017{rng.randint(10000000, 99999999)}',
+                'shipping_email': f'user{user_id}@example.com',
+                'notes': None,
+            })
+    return orders, items
+
+
+def synthetic_carts(crops, n, max_items=4, seed=0):
+    """Return n carts as the storefront sends them: crop rows with a quantity"""
+    rng = random.Random(seed)
+    return [
+        [{**crop, 'quantity': float(rng.randint(1, 20))} for crop in rng.sample(crops, rng.randint(1, min(max_items, len(crops))))]
+        for _ in range(n)
+    ]
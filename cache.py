@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional TTL and tag-based invalidation.
+
+    Entries can be tagged (e.g. with the crop ids they contain) so a write
+    only drops the entries it actually affects. Readers take the current
+    generation before querying the source and pass it back to set(); if an
+    invalidation happened in between, the possibly stale value is not stored.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, max_bytes=None, weigh=len):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Optional bound on the summed weigh(value), e.g. bytes of rendered files
+        self.max_bytes = max_bytes
+        self.weigh = weigh
+        self.bytes = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags, weight)
+        self._tags = defaultdict(set)  # tag -> keys
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        _, _, tags, weight = self._entries.pop(key)
+        self.bytes -= weight
+        for tag in tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, tags=(), generation=None):
+        """Store value; skipped if an invalidation ran since `generation`"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            if key in self._entries:
+                self._drop(key)
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            weight = self.weigh(value) if self.max_bytes else 0
+            if self.max_bytes and weight > self.max_bytes:
+                return False
+            tags = frozenset(tags)
+            self._entries[key] = (expires_at, value, tags, weight)
+            self.bytes += weight
+            for tag in tags:
+                self._tags[tag].add(key)
+            while len(self._entries) > self.maxsize or (self.max_bytes and self.bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    def invalidate_tags(self, tags):
+        """Drop every entry carrying any of the given tags"""
+        with self._lock:
+            self.generation += 1
+            for tag in set(tags):
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one computation.
+
+    The first caller runs fn(); callers arriving while it runs wait for and
+    share its result (or its exception) instead of computing it again.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}  # key -> Future of the running computation
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = self._calls[key] = Future()
+                leader = True
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
@@ -0,0 +1,341 @@
+import glob
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from cache import LRUCache
+from fast_json import FAST_JSON, EncodedRow, Fragment
+
+# Answer /api/crops from the in-process catalog snapshot instead of Supabase
+CROP_SEARCH_INDEX = os.getenv('CROP_SEARCH_INDEX', '0') == '1'
+# Where snapshot files live; workers on one host map the same file
+CATALOG_SNAPSHOT_DIR = os.getenv('CATALOG_SNAPSHOT_DIR', 'catalog_snapshots')
+# Crops per worker whose JSON encoding is kept between responses
+CATALOG_FRAGMENTS = int(os.getenv('CATALOG_FRAGMENTS', 10000))
+
+MAGIC = b'CROPCAT1'
+ALIGN = 64
+# Columns held as typed arrays; every other column is stored as JSON text
+NUMERIC = {'id': np.int64, 'price': np.float64, 'quantity': np.float64}
+CODED = ('type', 'region')
+# Ends each name in the search blob; a search term can't contain it
+SEPARATOR = '\0'
+
+
+def content_hash(crops):
+    """Hash of every column of every row; names the snapshot file"""
+    digest = hashlib.sha1()
+    for crop in crops:
+        digest.update(json.dumps(crop, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def pack_text(values):
+    """Strings -> (offsets, utf-8 blob); values[i] is blob[offsets[i]:offsets[i + 1]]"""
+    encoded = [value.encode() for value in values]
+    size = sum(len(value) for value in encoded)
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32 if size < 2**32 else np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def build_columns(crops):
+    """Columnar arrays and metadata for a list of crop rows, ordered by id"""
+    crops = sorted(crops, key=lambda crop: crop['id'])
+    columns = []
+    for crop in crops:
+        for column in crop:
+            if column not in columns:
+                columns.append(column)
+    arrays, vocabularies = {}, {}
+    for column, dtype in NUMERIC.items():
+        arrays[column] = np.array([crop[column] for crop in crops], dtype=dtype)
+    for column in CODED:
+        # Interned: each distinct string is stored once, rows hold its code
+        values = [crop[column] for crop in crops]
+        vocabularies[column] = sorted(set(values))
+        codes = {value: code for code, value in enumerate(vocabularies[column])}
+        arrays[f'{column}_code'] = np.array([codes[value] for value in values], dtype=np.int32)
+    for column in columns:
+        if column in NUMERIC or column in CODED:
+            continue
+        # An empty value means the row had no such key; JSON is never empty
+        text = [json.dumps(crop[column], default=str) if column in crop else '' for crop in crops]
+        arrays[f'{column}_offsets'], arrays[f'{column}_text'] = pack_text(text)
+    names = [crop['name'] for crop in crops]
+    arrays['name_length'] = np.array([len(name) for name in names], dtype=np.int32)
+    lowered = [name.lower().replace(SEPARATOR, '') for name in names]
+    offsets, blob = pack_text([name + SEPARATOR for name in lowered])
+    arrays['search_offsets'], arrays['search_text'] = offsets, blob
+    meta = {'columns': columns, 'vocabularies': vocabularies}
+    return arrays, meta
+
+
+def write_file(path, arrays, meta):
+    """Write arrays to one file, each aligned for mapping, replacing path atomically"""
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = json.dumps({'meta': meta, 'arrays': layout}).encode()
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC + len(header).to_bytes(8, 'little') + header)
+            for name, array in arrays.items():
+                f.seek(start + layout[name]['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(max(start + offset, f.tell()))
+        os.chmod(tmp_path, 0o644)  # mkstemp creates it private
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def map_file(path):
+    """Map a snapshot file read-only; returns (arrays, meta, mapping)"""
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapping[:len(MAGIC)] != MAGIC:
+        mapping.close()
+        raise ValueError(f'{path} is not a catalog snapshot')
+    size = int.from_bytes(mapping[len(MAGIC):len(MAGIC) + 8], 'little')
+    header = json.loads(mapping[len(MAGIC) + 8:len(MAGIC) + 8 + size])
+    start = -(-(len(MAGIC) + 8 + size) // ALIGN) * ALIGN
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+        count = int(np.prod(shape))
+        if count:
+            arrays[name] = np.frombuffer(mapping, dtype, count, start + spec['offset']).reshape(shape)
+        else:
+            arrays[name] = np.empty(shape, dtype)
+    return arrays, header['meta'], mapping
+
+
+class CatalogSnapshot:
+    """Read-only columnar copy of the crops table.
+
+    ids, prices and quantities are NumPy arrays; type and region are codes
+    into small interned vocabularies and the remaining columns are packed
+    text, so a row costs tens of bytes instead of a dict per crop. Opened
+    from a file, the arrays are views of a shared read-only mapping: every
+    worker on the host uses the same physical pages. Rows are turned back
+    into dicts only for the crops a response returns. It also behaves as a
+    sequence of crop dicts in id order, like the list it replaces.
+    """
+
+    def __init__(self, arrays, meta, fingerprint=None, mapping=None):
+        self.arrays = arrays
+        self.columns = meta['columns']
+        self.types = meta['vocabularies']['type']
+        self.regions = meta['vocabularies']['region']
+        self.fingerprint = fingerprint
+        self._mapping = mapping
+        self.ids = arrays['id']
+        self.prices = arrays['price']
+        self.quantities = arrays['quantity']
+        self.type_codes = arrays['type_code']
+        self.region_codes = arrays['region_code']
+        self.name_lengths = arrays['name_length']
+        # Local writes (stock after an order) layered over the read-only rows
+        self._patches = {}
+        self._lock = threading.Lock()
+        # Encoded rows of the crops responses return most, dropped when a crop is patched
+        self._fragments = LRUCache(maxsize=CATALOG_FRAGMENTS)
+
+    @classmethod
+    def from_rows(cls, crops):
+        """In-memory snapshot, e.g. when no snapshot directory is writable"""
+        arrays, meta = build_columns(crops)
+        return cls(arrays, meta, content_hash(crops))
+
+    @classmethod
+    def open(cls, path):
+        arrays, meta, mapping = map_file(path)
+        return cls(arrays, meta, meta.get('fingerprint'), mapping)
+
+    @property
+    def mapped(self):
+        return self._mapping is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        return self.row(position)
+
+    def __iter__(self):
+        return (self.row(position) for position in range(len(self)))
+
+    def _text(self, column, position):
+        offsets = self.arrays[f'{column}_offsets']
+        return self.arrays[f'{column}_text'][offsets[position]:offsets[position + 1]].tobytes()
+
+    def row(self, position):
+        """The crop at a position as a dict, keys in the table's column order"""
+        if not -len(self) <= position < len(self):
+            raise IndexError('catalog position out of range')
+        position = position % len(self)
+        crop = {}
+        for column in self.columns:
+            if column == 'id':
+                crop[column] = int(self.ids[position])
+            elif column in NUMERIC:
+                crop[column] = float(self.arrays[column][position])
+            elif column == 'type':
+                crop[column] = self.types[self.type_codes[position]]
+            elif column == 'region':
+                crop[column] = self.regions[self.region_codes[position]]
+            else:
+                text = self._text(column, position)
+                if text:
+                    crop[column] = json.loads(text)
+        patch = self._patches.get(crop['id'])
+        return {**crop, **patch} if patch else crop
+
+    def encoded_row(self, position, **fields):
+        """row() plus extra fields, carrying its JSON (see fast_json.EncodedRow).
+
+        The crop's own members are encoded once and reused until it is
+        patched; only the extra fields are encoded per call.
+        """
+        if not FAST_JSON:
+            return {**self.row(position), **fields}
+        # Taken before reading the row, so a patch in between isn't cached over
+        generation = self._fragments.generation
+        crop = self.row(position)
+        fragment = self._fragments.get(crop['id'])
+        if fragment is None:
+            fragment = Fragment(crop)
+            self._fragments.set(crop['id'], fragment, tags=[crop['id']], generation=generation)
+        return EncodedRow({**crop, **fields}, fragment.with_fields(fields))
+
+    def positions(self, crop_ids):
+        """Positions of crop ids in the snapshot, -1 for unknown ids"""
+        result = np.full(len(crop_ids), -1, dtype=np.int64)
+        wanted = [i for i, crop_id in enumerate(crop_ids)
+                  if isinstance(crop_id, (int, np.integer)) and not isinstance(crop_id, bool)]
+        if wanted and len(self):
+            keys = np.array([crop_ids[i] for i in wanted], dtype=np.int64)
+            found = np.minimum(np.searchsorted(self.ids, keys), len(self) - 1)
+            hit = self.ids[found] == keys
+            result[np.array(wanted)[hit]] = found[hit]
+        return result
+
+    def get(self, crop_id, default=None):
+        position = self.positions([crop_id])[0]
+        return default if position < 0 else self.row(position)
+
+    def patch(self, crop_id, changes):
+        """Apply a local write (e.g. a stock decrement) until the next snapshot"""
+        with self._lock:
+            self._patches[crop_id] = {**self._patches.get(crop_id, {}), **changes}
+        self._fragments.invalidate_tags([crop_id])
+
+    def _matching_names(self, term):
+        """Positions of crops whose lower-cased name contains term, and their relevance rank.
+
+        The rank comes from where the matches start: 0 for the whole name,
+        1 for a prefix, 2 for the start of a later word and 3 otherwise.
+        """
+        if SEPARATOR in term:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        needle = term.encode()
+        blob = self.arrays['search_text']
+        offsets = self.arrays['search_offsets']
+        # Vectorized scan of the packed names, straight from the mapping: start
+        # from every occurrence of the first byte and keep those that go on to
+        # spell the term (overlapping matches included)
+        starts = np.flatnonzero(blob[:max(len(blob) - len(needle) + 1, 0)] == needle[0])
+        for i in range(1, len(needle)):
+            starts = starts[blob[starts + i] == needle[i]]
+        if not len(starts):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        rows = np.searchsorted(offsets, starts, side='right') - 1
+        positions, group = np.unique(rows, return_inverse=True)
+        at_start = starts == offsets[rows]
+        after_space = ~at_start & (blob[np.maximum(starts - 1, 0)] == ord(' '))
+        prefix = np.bincount(group, weights=at_start, minlength=len(positions)) > 0
+        word = np.bincount(group, weights=after_space, minlength=len(positions)) > 0
+        # Names end with the separator, so an exact match is a prefix of the same length
+        exact = prefix & (offsets[positions + 1] - offsets[positions] - 1 == len(needle))
+        rank = np.full(len(positions), 3)
+        rank[word] = 2
+        rank[prefix] = 1
+        rank[exact] = 0
+        return positions, rank
+
+    def search(self, search='', crop_type='', region='', offset=0, limit=None, after=None):
+        """Return (page of crops, total matches) for the /api/crops filters.
+
+        Type and region compare integer codes over the whole column; a name
+        search scans the packed lower-cased names. With after set (keyset
+        paging) matches are ordered by id and start after that id instead of
+        being ranked by relevance.
+        """
+        term = search.lower()
+        mask = np.ones(len(self), dtype=bool)
+        for column, value, vocabulary in (('type_code', crop_type, self.types),
+                                          ('region_code', region, self.regions)):
+            if value:
+                code = vocabulary.index(value) if value in vocabulary else -1
+                mask &= self.arrays[column] == code
+        if term:
+            positions, rank = self._matching_names(term)
+            keep = mask[positions]
+            positions, rank = positions[keep], rank[keep]
+        else:
+            positions = np.flatnonzero(mask)
+        total = len(positions)
+        if after is not None:
+            positions = positions[self.ids[positions] > after]
+        elif term:
+            # Best rank first, then shorter names, then lower ids
+            positions = positions[np.lexsort((self.ids[positions], self.name_lengths[positions], rank))]
+        # Positions are in id order already (the snapshot is sorted by id)
+
+        end = None if limit is None else offset + limit
+        return [self.encoded_row(position) for position in positions[offset:end]], total
+
+
+def publish(crops, directory=CATALOG_SNAPSHOT_DIR, keep=2):
+    """Write (or reuse) the snapshot file for these rows and map it.
+
+    Files are named by content, so workers that load the same catalog map
+    the same file and the first one to get there writes it. Falls back to
+    an in-memory snapshot if the directory isn't writable.
+    """
+    fingerprint = content_hash(crops)
+    path = os.path.join(directory, f'crops-{fingerprint}.snap')
+    try:
+        if os.path.exists(path):
+            os.utime(path)  # Now the newest, so remove_old() keeps it
+        else:
+            os.makedirs(directory, exist_ok=True)
+            arrays, meta = build_columns(crops)
+            write_file(path, arrays, {**meta, 'fingerprint': fingerprint})
+            remove_old(directory, keep)
+        return CatalogSnapshot.open(path)
+    except OSError as e:
+        print(f"Catalog snapshot not written, keeping it in memory: {str(e)}")
+        return CatalogSnapshot.from_rows(crops)
+
+
+def remove_old(directory, keep):
+    """Delete all but the newest `keep` snapshots; mapped ones stay readable"""
+    paths = sorted(glob.glob(os.path.join(directory, 'crops-*.snap')), key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
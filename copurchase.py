@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+COPURCHASE_PATH = os.getenv('COPURCHASE_PATH', 'crop_copurchase.npz')
+# Share of the blended score that comes from co-purchases (0 turns them off)
+COPURCHASE_WEIGHT = float(os.getenv('COPURCHASE_WEIGHT', 0.3))
+# order_items rows fetched per request while mining
+COPURCHASE_CHUNK = int(os.getenv('COPURCHASE_CHUNK', 10000))
+# Rows younger than this are left for the next run, so orders still committing aren't skipped
+COPURCHASE_LAG = float(os.getenv('COPURCHASE_LAG', 60))
+# How often (in seconds) the service looks for a newer file from the job
+COPURCHASE_RELOAD_INTERVAL = float(os.getenv('COPURCHASE_RELOAD_INTERVAL', 60))
+# Distinct crops per order counted; bounds the pairs one huge order can add
+MAX_BASKET = 100
+
+
+class CoPurchaseIndex:
+    """Sparse crop-by-crop co-occurrence counts mined from order_items.
+
+    counts[i, j] is the number of orders containing both crop i and crop j
+    (the diagonal holds each crop's order count), indexed by crop id. The
+    job streams order_items by id in chunks, so memory is bounded by the
+    chunk and the matrix rather than by the number of order lines, and it
+    resumes from the last id it processed. Scores are cosine-normalized:
+    counts[i, j] / sqrt(counts[i, i] * counts[j, j]).
+    """
+
+    def __init__(self):
+        self.counts = None
+        self.watermark = 0  # Highest order_items.id already counted
+        self.loaded_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return 0 if self.counts is None else self.counts.nnz
+
+    def add_baskets(self, order_ids, crop_ids):
+        """Count one chunk of (order_id, crop_id) lines; returns the orders seen"""
+        from scipy import sparse
+
+        if not len(crop_ids):
+            return 0
+        orders, rows = np.unique(np.asarray(order_ids, dtype=object), return_inverse=True)
+        cols = np.asarray(crop_ids, dtype=np.int64)
+        size = int(cols.max()) + 1
+        # Binary order x crop incidence; B.T @ B counts shared orders for every pair
+        baskets = sparse.csr_matrix((np.ones(len(cols)), (rows, cols)), shape=(len(orders), size))
+        baskets.sum_duplicates()
+        baskets.data[:] = 1
+        if MAX_BASKET:
+            sizes = np.diff(baskets.indptr)
+            if sizes.max() > MAX_BASKET:
+                baskets = baskets[sizes <= MAX_BASKET]
+        chunk = (baskets.T @ baskets).tocsr()
+        with self._lock:
+            if self.counts is None:
+                self.counts = chunk
+            else:
+                size = max(size, self.counts.shape[0])
+                self.counts = resize(self.counts, size) + resize(chunk, size)
+        return len(orders)
+
+    def update(self, supabase, chunk_size=COPURCHASE_CHUNK, lag=COPURCHASE_LAG):
+        """Count order lines added since the last run; returns (lines, orders)"""
+        # created_at is a UTC timestamp without time zone
+        cutoff = (datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=lag)).isoformat()
+        lines = orders = 0
+        carry = []
+        while True:
+            rows = supabase.table('order_items').select('id, order_id, crop_id'
+                ).gt('id', self.watermark
+                ).lt('created_at', cutoff
+                ).order('id'
+                ).limit(chunk_size).execute().data
+            done = len(rows) < chunk_size
+            # The last order may continue in the next chunk; hold its lines back
+            rows = carry + rows
+            carry = [] if done else [row for row in rows if row['order_id'] == rows[-1]['order_id']]
+            ready = rows[:len(rows) - len(carry)]
+            orders += self.add_baskets([row['order_id'] for row in ready], [row['crop_id'] for row in ready])
+            lines += len(ready)
+            if ready:
+                self.watermark = max(self.watermark, max(row['id'] for row in ready))
+            if done:
+                return lines, orders
+            if len(carry) == len(rows):
+                # One order larger than a chunk: count it as it stands
+                orders += self.add_baskets([row['order_id'] for row in carry], [row['crop_id'] for row in carry])
+                lines += len(carry)
+                self.watermark = max(self.watermark, max(row['id'] for row in carry))
+                carry = []
+            elif carry:
+                # Continue after the rows already fetched; carried rows are replayed
+                self.watermark = max(self.watermark, max(row['id'] for row in carry))
+
+    def scores(self, crop_ids):
+        """Return (candidate ids, scores): for each crop its best score against any of crop_ids"""
+        counts = self.counts
+        if counts is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        known = [crop_id for crop_id in crop_ids if isinstance(crop_id, (int, np.integer)) and 0 <= crop_id < counts.shape[0]]
+        if not known:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        diagonal = counts.diagonal()
+        rows = counts[known].tocoo()
+        scale = np.sqrt(diagonal[np.asarray(known)[rows.row]] * diagonal[rows.col])
+        best = {}
+        for col, score in zip(rows.col.tolist(), (rows.data / scale).tolist()):
+            if score > best.get(col, 0.0):
+                best[col] = score
+        for crop_id in known:
+            best.pop(crop_id, None)
+        candidates = np.array(list(best), dtype=np.int64)
+        return candidates, np.array([best[crop_id] for crop_id in candidates.tolist()])
+
+    def save(self, path=COPURCHASE_PATH):
+        from scipy import sparse
+
+        tmp_path = f'{path}.tmp.npz'
+        counts = self.counts if self.counts is not None else sparse.csr_matrix((0, 0))
+        np.savez_compressed(tmp_path, data=counts.data, indices=counts.indices, indptr=counts.indptr,
+                            shape=np.array(counts.shape), watermark=np.array(self.watermark))
+        os.replace(tmp_path, path)
+
+    def load(self, path=COPURCHASE_PATH):
+        # Raises OSError before scipy is imported when the job hasn't written a file
+        mtime = os.path.getmtime(path)
+        from scipy import sparse
+
+        with np.load(path) as data:
+            counts = sparse.csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape']))
+            watermark = int(data['watermark'])
+        with self._lock:
+            self.counts = counts if counts.nnz else None
+            self.watermark = watermark
+            self.loaded_mtime = mtime
+
+    def refresh(self, path=COPURCHASE_PATH, interval=COPURCHASE_RELOAD_INTERVAL):
+        """Load the job's file again if it changed; returns True when reloaded"""
+        now = time.monotonic()
+        if now - self._checked_at < interval:
+            return False
+        self._checked_at = now
+        try:
+            if os.path.getmtime(path) == self.loaded_mtime:
+                return False
+            self.load(path)
+        except OSError:
+            return False
+        return True
+
+
+def resize(matrix, size):
+    """Pad a square sparse matrix with empty rows and columns up to size"""
+    if matrix.shape[0] == size:
+        return matrix
+    matrix = matrix.tocsr(copy=True)
+    matrix.resize((size, size))
+    return matrix
+
+
+if __name__ == '__main__':
+    # Offline job: python copurchase.py [--full]; resumes from the saved watermark
+    import sys
+
+    from ai_service import supabase
+
+    index = CoPurchaseIndex()
+    if '--full' not in sys.argv and os.path.exists(COPURCHASE_PATH):
+        index.load()
+    lines, orders = index.update(supabase)
+    index.save()
+    print(f"Counted {lines} order lines from {orders} orders; {len(index)} crop pairs saved to {COPURCHASE_PATH}")
@@ -0,0 +1,56 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Concurrent queries per process and how long a request waits for them
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+DB_TIMEOUT = float(os.getenv('DB_TIMEOUT', 10))
+
+
+class QueryPool:
+    """Runs independent Supabase queries concurrently on a bounded thread pool.
+
+    All queries still go through the one Supabase client, whose HTTP session
+    keeps its connections alive, so running them side by side adds no new
+    handshakes; a handler waits for the slowest query instead of the sum.
+    With max_workers=0 queries run one after another on the calling thread.
+    """
+
+    def __init__(self, max_workers=DB_POOL_SIZE, timeout=DB_TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        if max_workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+
+    @staticmethod
+    def _run(query):
+        # Query builders are executed; anything else is called as-is
+        if hasattr(query, 'execute'):
+            return query.execute()
+        return query()
+
+    def gather(self, *queries):
+        """Run the queries concurrently and return their results in order.
+
+        None entries are skipped (their result is None). The first error is
+        re-raised; TimeoutError if they don't all finish within the timeout.
+        """
+        if self._executor is None:
+            return [None if query is None else self._run(query) for query in queries]
+        # Each query runs in a copy of the caller's context (request timings etc.)
+        futures = [
+            None if query is None else self._executor.submit(contextvars.copy_context().run, self._run, query)
+            for query in queries
+        ]
+        pending = [future for future in futures if future is not None]
+        _, not_done = wait(pending, timeout=self.timeout)
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            raise TimeoutError(f'Queries did not finish within {self.timeout}s')
+        return [None if future is None else future.result() for future in futures]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
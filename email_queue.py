@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import queue
+import smtplib
+import threading
+import time
+
+from metrics import timed
+
+
+class EmailQueue:
+    """Background email delivery over persistent, authenticated SMTP sessions.
+
+    enqueue() returns immediately. Each worker thread keeps its own SMTP
+    connection open between messages (reconnecting when it drops or has been
+    idle too long) and drains up to batch_size queued messages per wake-up.
+    Failed sends are retried with exponential backoff, then dropped.
+    """
+
+    def __init__(self, host, port, user=None, password=None, starttls=True, workers=1, batch_size=20,
+                 max_retries=5, backoff=2.0, idle_timeout=60, timeout=30, smtp_class=smtplib.SMTP):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.smtp_class = smtp_class
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._queue = queue.Queue()
+        self._seq = itertools.count()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+    def _start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'email-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, msg):
+        """Queue a message for delivery; never blocks on the mail server"""
+        if self._closed:
+            raise RuntimeError('Email queue is closed')
+        self._start()
+        with self._idle:
+            self._pending += 1
+        self._queue.put((0, msg))
+
+    def _done(self, outcome):
+        """Count a message as 'sent' or 'failed' and wake flush()"""
+        # Counters share the lock with _pending: several workers update them
+        with self._idle:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self._pending -= 1
+            self._idle.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until every queued message was sent or given up on"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout=10):
+        """Deliver what is queued (up to timeout) and stop the workers"""
+        self.flush(timeout)
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _connect(self):
+        server = self.smtp_class(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.user and self.password:
+            server.login(self.user, self.password)
+        return server
+
+    @staticmethod
+    def _disconnect(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @staticmethod
+    def _alive(server):
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _run(self):
+        server = None
+        last_used = 0.0
+        delayed = []  # Heap of (ready_at, seq, attempt, msg) waiting for a retry
+        while True:
+            # Sleep until a message arrives or the next retry is due
+            wait = None
+            if delayed:
+                wait = max(0.0, delayed[0][0] - time.monotonic())
+            elif server is not None:
+                wait = self.idle_timeout
+            try:
+                entry = self._queue.get(timeout=wait)
+            except queue.Empty:
+                entry = False
+            if entry is None:
+                break
+
+            batch = [entry] if entry else []
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self._queue.put(None)  # Handle shutdown after this batch
+                    break
+                batch.append(entry)
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now and len(batch) < self.batch_size:
+                _, _, attempt, msg = heapq.heappop(delayed)
+                batch.append((attempt, msg))
+
+            if server is not None and now - last_used >= self.idle_timeout:
+                self._disconnect(server)
+                server = None
+            if not batch:
+                continue
+            # One NOOP per batch catches connections the server has dropped
+            if server is not None and not self._alive(server):
+                self._disconnect(server)
+                server = None
+
+            for attempt, msg in batch:
+                try:
+                    if server is None:
+                        server = self._connect()
+                    with timed('email'):
+                        server.send_message(msg)
+                    last_used = time.monotonic()
+                    self._done('sent')
+                except Exception as e:
+                    if server is not None:
+                        self._disconnect(server)
+                        server = None
+                    if attempt < self.max_retries:
+                        with self._idle:
+                            self.retried += 1
+                        ready_at = time.monotonic() + self.backoff ** attempt
+                        heapq.heappush(delayed, (ready_at, next(self._seq), attempt + 1, msg))
+                    else:
+                        print(f"Failed to send email: {str(e)}")
+                        self._done('failed')
+
+        if server is not None:
+            self._disconnect(server)
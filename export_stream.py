@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+import os
+import zlib
+
+# Rows per Supabase read; PostgREST usually caps a response at 1000 rows
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+# Exportable tables and their columns, in CSV order (see init_db.sql)
+EXPORT_TABLES = {
+    'crops': ('id', 'name', 'type', 'quantity', 'price', 'region', 'description', 'image_url',
+              'created_at', 'updated_at'),
+    'orders': ('id', 'user_id', 'order_date', 'total_amount', 'status', 'payment_method', 'payment_status',
+               'shipping_name', 'shipping_address', 'shipping_region', 'shipping_phone', 'shipping_email',
+               'notes', 'created_at', 'updated_at'),
+    'order_items': ('id', 'order_id', 'crop_id', 'quantity', 'unit_price', 'total_price', 'created_at'),
+}
+# Tables whose id is a SERIAL rather than a UUID
+INTEGER_IDS = {'crops', 'order_items'}
+
+
+def parse_after(table, value):
+    """The id to resume after, typed like the table's id; raises ValueError"""
+    if table in INTEGER_IDS:
+        return int(value)
+    if len(value) != 36:
+        raise ValueError('after must be an order id')
+    return value
+
+
+def iter_batches(supabase, table, after=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield lists of rows in id order with keyset reads (id > last id).
+
+    Only one batch is held at a time. The loop ends on an empty read rather
+    than a short one, so a server-side row cap smaller than batch_size
+    can't end the export early.
+    """
+    columns = ', '.join(EXPORT_TABLES[table])
+    while True:
+        query = supabase.table(table).select(columns)
+        if after is not None:
+            query = query.gt('id', after)
+        rows = query.order('id').limit(batch_size).execute().data
+        if not rows:
+            return
+        yield rows
+        after = rows[-1]['id']
+
+
+def ndjson_chunks(batches):
+    """One JSON object per line, one chunk per batch"""
+    for rows in batches:
+        yield ''.join(json.dumps(row, default=str, separators=(',', ':')) + '\n' for row in rows).encode()
+
+
+def csv_chunks(batches, columns, header=True):
+    """CSV with a header row (left out when resuming), one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore', lineterminator='\n')
+    if header:
+        writer.writeheader()
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """gzip a byte stream incrementally.
+
+    Every chunk ends with a sync flush, so whatever arrived before a dropped
+    connection decompresses up to the last complete batch.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: gzip header and trailer
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def tracked(batches, progress):
+    """Pass batches through, recording the id of the last row handed on"""
+    for rows in batches:
+        yield rows
+        progress['after'] = rows[-1]['id']
+
+
+def error_marker(chunks, fmt, progress):
+    """End a failed export with a marker line instead of a silently short body.
+
+    The status line has long been sent, so the marker is the only way to tell
+    the client: a JSON object with an "error" key for NDJSON, a line starting
+    with '#' for CSV. Both carry the id to resume from as after.
+    """
+    try:
+        yield from chunks
+    except Exception as e:
+        print(f"Export failed: {str(e)}")
+        if fmt == 'csv':
+            yield f"# export incomplete: {str(e)}; resume with after={progress['after']}\n".encode()
+        else:
+            marker = {'error': str(e), 'complete': False, 'after': progress['after']}
+            yield (json.dumps(marker, default=str, separators=(',', ':')) + '\n').encode()
+
+
+def export_stream(supabase, table, fmt='ndjson', after=None, compress=False, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the encoded bytes of a table export"""
+    progress = {'after': after}
+    batches = tracked(iter_batches(supabase, table, after, batch_size), progress)
+    if fmt == 'csv':
+        chunks = csv_chunks(batches, EXPORT_TABLES[table], header=after is None)
+    else:
+        chunks = ndjson_chunks(batches)
+    chunks = error_marker(chunks, fmt, progress)
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,27 @@
+"""gunicorn settings, picked up automatically by `gunicorn ai_service:app`.
+
+GUNICORN_PRELOAD=1 imports the app in the master and loads the recommender
+model, crop catalog and lazily imported libraries there before forking, so
+workers share those pages copy-on-write instead of each loading their own.
+"""
+import gc
+import os
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', 5000)}")
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1'
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before any worker forks
+    if not preload_app:
+        return
+    import ai_service
+
+    try:
+        ai_service.warm_up()
+    except Exception as e:
+        server.log.warning(f"Warm-up failed, workers will load the model themselves: {str(e)}")
+    # Keep the garbage collector from touching (and so copying) the shared objects
+    gc.freeze()
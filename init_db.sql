@@ -65,16 +65,325 @@ CREATE TABLE IF NOT EXISTS payments (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Running price and trade totals per crop type, region and day, kept up to
+-- date by the triggers below. Each day's totals are split over 8 shards
+-- (picked per transaction) so concurrent orders don't queue on one row.
+CREATE TABLE IF NOT EXISTS market_prices (
+    type VARCHAR(50) NOT NULL,
+    region VARCHAR(100) NOT NULL,
+    day DATE NOT NULL,
+    shard SMALLINT NOT NULL,
+    price_count INTEGER NOT NULL DEFAULT 0,
+    price_sum NUMERIC NOT NULL DEFAULT 0,
+    price_min DECIMAL(10, 2),
+    price_max DECIMAL(10, 2),
+    traded_quantity NUMERIC NOT NULL DEFAULT 0,
+    traded_value NUMERIC NOT NULL DEFAULT 0,
+    PRIMARY KEY (type, region, day, shard)
+);
+
+-- Stock the servers' reservation engines (inventory.py) have leased and not
+-- sold yet, and when one of them last came up short of it. A recent
+-- wanted_at asks the holders to give their stock back.
+CREATE TABLE IF NOT EXISTS stock_leases (
+    crop_id INTEGER PRIMARY KEY REFERENCES crops(id) ON DELETE CASCADE,
+    quantity DECIMAL(10, 2) NOT NULL DEFAULT 0,
+    wanted_at TIMESTAMP
+);
+
 -- Create indexes
 CREATE INDEX idx_crop_region ON crops(region);
 CREATE INDEX idx_crop_type ON crops(type);
 CREATE INDEX idx_crop_price ON crops(price);
+-- catalog_version() in recommender.py reads the latest updated_at
+CREATE INDEX idx_crop_updated_at ON crops(updated_at);
 CREATE INDEX idx_user_type ON users(user_type);
 CREATE INDEX idx_orders_user_id ON orders(user_id);
 CREATE INDEX idx_orders_status ON orders(status);
 CREATE INDEX idx_order_items_order_id ON order_items(order_id);
 CREATE INDEX idx_order_items_crop_id ON order_items(crop_id);
 CREATE INDEX idx_payments_order_id ON payments(order_id);
+CREATE INDEX idx_market_prices_day ON market_prices(day);
+
+-- Create an order, its items and the stock decrements in one transaction.
+-- Called by the API as a single RPC; returns the new quantity of each crop.
+DROP FUNCTION IF EXISTS create_order(JSONB, JSONB);
+CREATE OR REPLACE FUNCTION create_order(p_order JSONB, p_items JSONB, p_reserved BOOLEAN DEFAULT FALSE)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_updated JSONB;
+    v_short INTEGER;
+BEGIN
+    IF NOT p_reserved THEN
+        -- Lock the rows in id order (no deadlocks between orders) and refuse to oversell
+        SELECT o.crop_id INTO v_short
+        FROM (
+            SELECT x.crop_id, SUM(x.quantity) AS quantity
+            FROM jsonb_to_recordset(p_items) AS x(crop_id INTEGER, quantity DECIMAL)
+            GROUP BY x.crop_id
+        ) o
+        LEFT JOIN (
+            SELECT c.id, c.quantity FROM crops c
+            WHERE c.id IN (SELECT x.crop_id FROM jsonb_to_recordset(p_items) AS x(crop_id INTEGER))
+            ORDER BY c.id
+            FOR NO KEY UPDATE
+        ) c ON c.id = o.crop_id
+        WHERE c.quantity IS NULL OR c.quantity < o.quantity
+        LIMIT 1;
+        IF v_short IS NOT NULL THEN
+            RAISE EXCEPTION 'insufficient_stock' USING DETAIL = v_short;
+        END IF;
+    END IF;
+
+    INSERT INTO orders (id, user_id, order_date, total_amount, status, payment_method, payment_status,
+                        shipping_address, shipping_region, shipping_phone, shipping_email)
+    SELECT id, user_id, order_date, total_amount, status, payment_method, payment_status,
+           shipping_address, shipping_region, shipping_phone, shipping_email
+    FROM jsonb_populate_record(NULL::orders, p_order);
+
+    INSERT INTO order_items (order_id, crop_id, quantity, unit_price, total_price)
+    SELECT (p_order->>'id')::UUID, x.crop_id, x.quantity, x.unit_price, x.total_price
+    FROM jsonb_to_recordset(p_items) AS x(crop_id INTEGER, quantity DECIMAL, unit_price DECIMAL, total_price DECIMAL);
+
+    -- Stock was already taken with lease_stock() by the caller's reservation engine
+    IF p_reserved THEN
+        UPDATE stock_leases l SET quantity = GREATEST(l.quantity - o.quantity, 0)
+        FROM (
+            SELECT x.crop_id, SUM(x.quantity) AS quantity
+            FROM jsonb_to_recordset(p_items) AS x(crop_id INTEGER, quantity DECIMAL)
+            GROUP BY x.crop_id
+        ) o
+        WHERE l.crop_id = o.crop_id;
+        RETURN '[]'::JSONB;
+    END IF;
+
+    WITH ordered AS (
+        SELECT x.crop_id, SUM(x.quantity) AS quantity
+        FROM jsonb_to_recordset(p_items) AS x(crop_id INTEGER, quantity DECIMAL)
+        GROUP BY x.crop_id
+    ), updated AS (
+        UPDATE crops c SET quantity = c.quantity - o.quantity
+        FROM ordered o
+        WHERE c.id = o.crop_id
+        RETURNING c.id, c.quantity
+    )
+    SELECT COALESCE(jsonb_agg(jsonb_build_object('id', id, 'quantity', quantity)), '[]'::JSONB)
+    INTO v_updated
+    FROM updated;
+
+    RETURN v_updated;
+END;
+$$;
+
+-- Moves stock from crops.quantity into a server's in-memory reservation pool.
+-- Each request row asks for the quantity an order needs plus up to `extra`
+-- more, and the extra is capped at p_share of what the need leaves, so one
+-- server can't take a crop's whole stock; while a crop is wanted (a server
+-- came up short in the last 5 seconds) nobody gets extra. A request that
+-- can't be met marks the crop wanted. Returns [{id, quantity, leased}]:
+-- the quantity granted and the total now leased out by all servers.
+DROP FUNCTION IF EXISTS lease_stock(JSONB);
+CREATE OR REPLACE FUNCTION lease_stock(p_requests JSONB, p_share DECIMAL DEFAULT 1)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_granted JSONB;
+BEGIN
+    PERFORM 1 FROM crops
+    WHERE id IN (SELECT x.crop_id FROM jsonb_to_recordset(p_requests) AS x(crop_id INTEGER))
+    ORDER BY id
+    FOR NO KEY UPDATE;
+
+    WITH requested AS (
+        SELECT x.crop_id, SUM(x.quantity) AS quantity, SUM(COALESCE(x.extra, 0)) AS extra
+        FROM jsonb_to_recordset(p_requests) AS x(crop_id INTEGER, quantity DECIMAL, extra DECIMAL)
+        GROUP BY x.crop_id
+    ), available AS (
+        SELECT c.id, r.quantity AS needed, GREATEST(c.quantity, 0) AS stock,
+               CASE WHEN l.wanted_at > now() - INTERVAL '5 seconds' THEN 0 ELSE r.extra END AS extra
+        FROM crops c
+        JOIN requested r ON r.crop_id = c.id
+        LEFT JOIN stock_leases l ON l.crop_id = c.id
+    ), granted AS (
+        SELECT id, needed, LEAST(needed, stock)
+                   + LEAST(extra, FLOOR(GREATEST(stock - needed, 0) * p_share)) AS quantity
+        FROM available
+    ), updated AS (
+        UPDATE crops c SET quantity = c.quantity - g.quantity
+        FROM granted g
+        WHERE c.id = g.id AND g.quantity > 0
+    ), leased AS (
+        INSERT INTO stock_leases AS l (crop_id, quantity, wanted_at)
+        SELECT id, quantity, CASE WHEN quantity < needed THEN now() END
+        FROM granted
+        ON CONFLICT (crop_id) DO UPDATE SET
+            quantity = l.quantity + EXCLUDED.quantity,
+            wanted_at = COALESCE(EXCLUDED.wanted_at, l.wanted_at)
+        RETURNING l.crop_id, l.quantity
+    )
+    SELECT COALESCE(jsonb_agg(jsonb_build_object('id', g.id, 'quantity', g.quantity, 'leased', l.quantity)), '[]'::JSONB)
+    INTO v_granted
+    FROM granted g
+    JOIN leased l ON l.crop_id = g.id;
+
+    RETURN v_granted;
+END;
+$$;
+
+-- Puts unsold reserved stock back into crops.quantity
+CREATE OR REPLACE FUNCTION return_stock(p_returns JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    WITH returned AS (
+        SELECT x.crop_id, SUM(x.quantity) AS quantity
+        FROM jsonb_to_recordset(p_returns) AS x(crop_id INTEGER, quantity DECIMAL)
+        GROUP BY x.crop_id
+    ), leases AS (
+        UPDATE stock_leases l SET quantity = GREATEST(l.quantity - r.quantity, 0)
+        FROM returned r
+        WHERE l.crop_id = r.crop_id
+    )
+    UPDATE crops c SET quantity = c.quantity + r.quantity
+    FROM returned r
+    WHERE c.id = r.crop_id;
+$$;
+
+-- Crops among p_crop_ids that a server came up short of in the last 5 seconds;
+-- servers holding leased stock of them give it back
+CREATE OR REPLACE FUNCTION wanted_stock(p_crop_ids JSONB)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(jsonb_agg(l.crop_id), '[]'::JSONB)
+    FROM stock_leases l
+    WHERE l.crop_id IN (SELECT jsonb_array_elements_text(p_crop_ids)::INTEGER)
+      AND l.wanted_at > now() - INTERVAL '5 seconds';
+$$;
+
+-- Stamps every change to a crop (edits and stock alike), so the servers'
+-- catalog version check sees it and reloads
+CREATE OR REPLACE FUNCTION touch_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS crops_touch_updated_at ON crops;
+CREATE TRIGGER crops_touch_updated_at BEFORE UPDATE ON crops
+FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+-- Counts a crop's price in market_prices when it is listed or its price changes
+CREATE OR REPLACE FUNCTION record_listing_price()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO market_prices AS m (type, region, day, shard, price_count, price_sum, price_min, price_max)
+    VALUES (NEW.type, NEW.region, CURRENT_DATE, (txid_current() % 8)::SMALLINT, 1, NEW.price, NEW.price, NEW.price)
+    ON CONFLICT (type, region, day, shard) DO UPDATE SET
+        price_count = m.price_count + 1,
+        price_sum = m.price_sum + EXCLUDED.price_sum,
+        price_min = LEAST(m.price_min, EXCLUDED.price_min),
+        price_max = GREATEST(m.price_max, EXCLUDED.price_max);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS crops_listed_price ON crops;
+CREATE TRIGGER crops_listed_price AFTER INSERT ON crops
+FOR EACH ROW EXECUTE FUNCTION record_listing_price();
+
+-- Stock changes leave the price alone and skip the trigger
+DROP TRIGGER IF EXISTS crops_changed_price ON crops;
+CREATE TRIGGER crops_changed_price AFTER UPDATE ON crops
+FOR EACH ROW
+WHEN (OLD.price IS DISTINCT FROM NEW.price OR OLD.type IS DISTINCT FROM NEW.type OR OLD.region IS DISTINCT FROM NEW.region)
+EXECUTE FUNCTION record_listing_price();
+
+-- Adds the lines of each order to market_prices in the order's own transaction:
+-- one upsert per market for the whole statement, in key order so two orders
+-- touching the same markets can't deadlock.
+CREATE OR REPLACE FUNCTION record_trades()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO market_prices AS m (type, region, day, shard, price_count, price_sum, price_min, price_max,
+                                    traded_quantity, traded_value)
+    SELECT c.type, c.region, n.created_at::DATE, (txid_current() % 8)::SMALLINT,
+           COUNT(*), SUM(n.unit_price), MIN(n.unit_price), MAX(n.unit_price), SUM(n.quantity), SUM(n.total_price)
+    FROM new_items n
+    JOIN crops c ON c.id = n.crop_id
+    GROUP BY c.type, c.region, n.created_at::DATE
+    ORDER BY c.type, c.region, n.created_at::DATE
+    ON CONFLICT (type, region, day, shard) DO UPDATE SET
+        price_count = m.price_count + EXCLUDED.price_count,
+        price_sum = m.price_sum + EXCLUDED.price_sum,
+        price_min = LEAST(m.price_min, EXCLUDED.price_min),
+        price_max = GREATEST(m.price_max, EXCLUDED.price_max),
+        traded_quantity = m.traded_quantity + EXCLUDED.traded_quantity,
+        traded_value = m.traded_value + EXCLUDED.traded_value;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS order_items_trades ON order_items;
+CREATE TRIGGER order_items_trades AFTER INSERT ON order_items
+REFERENCING NEW TABLE AS new_items
+FOR EACH STATEMENT EXECUTE FUNCTION record_trades();
+
+-- Per-day totals of each market since p_since (shards added up), newest first.
+-- Reads at most days x markets x 8 rows however long the order history is.
+CREATE OR REPLACE FUNCTION market_summary(p_since DATE, p_type TEXT DEFAULT NULL, p_region TEXT DEFAULT NULL)
+RETURNS TABLE (type VARCHAR, region VARCHAR, day DATE, price_count BIGINT, price_sum NUMERIC,
+               price_min NUMERIC, price_max NUMERIC, traded_quantity NUMERIC, traded_value NUMERIC)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT m.type, m.region, m.day, SUM(m.price_count), SUM(m.price_sum), MIN(m.price_min), MAX(m.price_max),
+           SUM(m.traded_quantity), SUM(m.traded_value)
+    FROM market_prices m
+    WHERE m.day >= p_since
+      AND (p_type IS NULL OR m.type = p_type)
+      AND (p_region IS NULL OR m.region = p_region)
+    GROUP BY m.type, m.region, m.day
+    ORDER BY m.day DESC, m.type, m.region;
+$$;
+
+-- Databases that already have orders: fill market_prices from the history once
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM market_prices) THEN
+        INSERT INTO market_prices (type, region, day, shard, price_count, price_sum, price_min, price_max,
+                                   traded_quantity, traded_value)
+        SELECT c.type, c.region, oi.created_at::DATE, 0,
+               COUNT(*), SUM(oi.unit_price), MIN(oi.unit_price), MAX(oi.unit_price), SUM(oi.quantity), SUM(oi.total_price)
+        FROM order_items oi
+        JOIN crops c ON c.id = oi.crop_id
+        GROUP BY c.type, c.region, oi.created_at::DATE;
+
+        -- Today's listed prices
+        INSERT INTO market_prices AS m (type, region, day, shard, price_count, price_sum, price_min, price_max)
+        SELECT type, region, CURRENT_DATE, 0, COUNT(*), SUM(price), MIN(price), MAX(price)
+        FROM crops
+        GROUP BY type, region
+        ON CONFLICT (type, region, day, shard) DO UPDATE SET
+            price_count = m.price_count + EXCLUDED.price_count,
+            price_sum = m.price_sum + EXCLUDED.price_sum,
+            price_min = LEAST(m.price_min, EXCLUDED.price_min),
+            price_max = GREATEST(m.price_max, EXCLUDED.price_max);
+    END IF;
+END;
+$$;
 
 -- Insert sample data
 INSERT INTO users (username, email, password_hash, user_type, full_name, phone, address, region) VALUES
@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from decimal import Decimal
+
+from order_store import InsufficientStock
+
+# Reserve stock in memory and take it from the database in blocks
+INVENTORY_ENGINE = os.getenv('INVENTORY_ENGINE', '0') == '1'
+# Extra units leased per refill, so a hot crop needs one database write per block
+INVENTORY_LEASE_SIZE = Decimal(os.getenv('INVENTORY_LEASE_SIZE', '100'))
+# ...but never more than this share of the stock left, so other workers still find some
+INVENTORY_LEASE_SHARE = Decimal(os.getenv('INVENTORY_LEASE_SHARE', '0.1'))
+# Unsold leased stock goes back to the database after this many idle seconds
+INVENTORY_IDLE_RETURN = float(os.getenv('INVENTORY_IDLE_RETURN', 10))
+# How often a worker holding stock checks whether another one came up short of it
+INVENTORY_DEMAND_POLL = float(os.getenv('INVENTORY_DEMAND_POLL', 0.2))
+# How long a short order waits for other workers to give their stock back
+INVENTORY_CLAIM_WAIT = float(os.getenv('INVENTORY_CLAIM_WAIT', 1))
+# After the database runs out of a crop, reject without asking again for this long
+INVENTORY_SOLD_OUT_TTL = float(os.getenv('INVENTORY_SOLD_OUT_TTL', 1))
+
+
+def quantities(items):
+    """Sum order items per crop: {crop_id: Decimal quantity}"""
+    totals = {}
+    for item in items:
+        totals[item['crop_id']] = totals.get(item['crop_id'], Decimal(0)) + Decimal(str(item['quantity']))
+    return totals
+
+
+class InventoryEngine:
+    """Atomic stock reservations that don't serialize checkouts on a row lock.
+
+    Each process leases stock from crops.quantity in blocks (lease_stock() in
+    init_db.sql, which never grants more than is left, nor a block bigger
+    than lease_share of it) and reserves orders against its lease under
+    per-crop locks. An order either gets all of its crops or none. Because
+    stock leaves the database before it is sold, several workers can never
+    oversell between them.
+
+    A worker that comes up short marks the crop wanted; workers holding
+    some of it see that within demand_poll seconds and give it back, and
+    the short order waits up to claim_wait for it. Orders are only rejected
+    with InsufficientStock when no worker holds any more. Unsold stock is
+    also returned once the crop goes idle, and on close().
+    """
+
+    def __init__(self, store, lease_size=INVENTORY_LEASE_SIZE, idle_return=INVENTORY_IDLE_RETURN,
+                 sold_out_ttl=INVENTORY_SOLD_OUT_TTL, lease_share=INVENTORY_LEASE_SHARE,
+                 demand_poll=INVENTORY_DEMAND_POLL, claim_wait=INVENTORY_CLAIM_WAIT):
+        self.store = store
+        self.lease_size = Decimal(str(lease_size))
+        self.lease_share = Decimal(str(lease_share))
+        self.idle_return = idle_return
+        self.sold_out_ttl = sold_out_ttl
+        self.demand_poll = demand_poll
+        self.claim_wait = claim_wait
+        self.leases = 0
+        self.rejected = 0
+        self.given_back = 0
+        self._held = {}  # crop_id -> leased, unsold Decimal quantity
+        self._used_at = {}  # crop_id -> monotonic time of the last reservation
+        self._sold_out = {}  # crop_id -> monotonic time the database had none left
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._returner = None
+        self._stop = threading.Event()
+
+    def _lock(self, crop_id):
+        lock = self._locks.get(crop_id)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(crop_id, threading.Lock())
+        return lock
+
+    def _start(self):
+        if self._returner is None and (self.idle_return or self.demand_poll):
+            with self._locks_guard:
+                if self._returner is None:
+                    self._returner = threading.Thread(target=self._return_loop, name='inventory-return', daemon=True)
+                    self._returner.start()
+
+    def held(self, crop_id):
+        return self._held.get(crop_id, Decimal(0))
+
+    def reserve(self, items):
+        """Reserve every item's quantity or raise InsufficientStock; returns the reservation"""
+        self._start()
+        wanted = quantities(items)
+        # Locks are always taken in crop id order, so reservations can't deadlock
+        locks = [self._lock(crop_id) for crop_id in sorted(wanted)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            now = time.monotonic()
+            short = {crop_id: quantity - self.held(crop_id)
+                     for crop_id, quantity in wanted.items() if self.held(crop_id) < quantity}
+            for crop_id in short:
+                if now - self._sold_out.get(crop_id, float('-inf')) < self.sold_out_ttl:
+                    self.rejected += 1
+                    raise InsufficientStock(crop_id)
+            deadline = now + self.claim_wait
+            extra = {crop_id: self.lease_size for crop_id in short}
+            while short:
+                # One round trip refills every crop this order is short of
+                elsewhere = self._lease(short, extra)
+                short = {crop_id: quantity - self.held(crop_id)
+                         for crop_id, quantity in wanted.items() if self.held(crop_id) < quantity}
+                if not short:
+                    break
+                # Other workers hold the rest until they see the crop is wanted;
+                # if none of them hold any, it is sold out
+                sold_out = [crop_id for crop_id in short if elsewhere.get(crop_id, 0) <= 0]
+                if sold_out or time.monotonic() >= deadline:
+                    crop_id = min(sold_out or short)
+                    if sold_out:
+                        self._sold_out[crop_id] = time.monotonic()
+                    self.rejected += 1
+                    raise InsufficientStock(crop_id)
+                time.sleep(self.demand_poll / 2 if self.demand_poll else 0.05)
+                extra = None
+            for crop_id, quantity in wanted.items():
+                self._held[crop_id] -= quantity
+                self._used_at[crop_id] = now
+            return wanted
+        finally:
+            for lock in locks:
+                lock.release()
+
+    def _lease(self, short, extra):
+        """Lease what an order is short of; returns {crop_id: stock other workers hold}"""
+        granted = self.store.lease_stock(short, extra, self.lease_share)
+        self.leases += 1
+        elsewhere = {}
+        for crop_id, (quantity, leased) in granted.items():
+            self._held[crop_id] = self.held(crop_id) + Decimal(str(quantity))
+            # Includes this worker's reservations whose orders aren't written yet
+            elsewhere[crop_id] = Decimal(str(leased)) - self.held(crop_id)
+            if quantity:
+                self._sold_out.pop(crop_id, None)
+        return elsewhere
+
+    def release(self, reservation):
+        """Put a reservation back, e.g. when writing its order failed"""
+        for crop_id, quantity in reservation.items():
+            with self._lock(crop_id):
+                self._held[crop_id] = self.held(crop_id) + quantity
+
+    def return_idle(self, idle_for=None):
+        """Give unsold stock of crops idle for `idle_for` seconds back to the database"""
+        idle_for = self.idle_return if idle_for is None else idle_for
+        return self._give_back(list(self._held), idle_for)
+
+    def return_wanted(self):
+        """Give back unsold stock of crops another worker came up short of"""
+        held = [crop_id for crop_id, quantity in list(self._held.items()) if quantity > 0]
+        if not held:
+            return {}
+        try:
+            wanted = self.store.wanted_stock(held)
+        except Exception as e:
+            print(f"Failed to check wanted stock: {str(e)}")
+            return {}
+        returned = self._give_back(sorted(wanted))
+        self.given_back += len(returned)
+        return returned
+
+    def _give_back(self, crop_ids, idle_for=0):
+        now = time.monotonic()
+        returned = {}
+        for crop_id in crop_ids:
+            with self._lock(crop_id):
+                if now - self._used_at.get(crop_id, 0.0) < idle_for:
+                    continue
+                quantity = self._held.pop(crop_id, Decimal(0))
+                if quantity > 0:
+                    returned[crop_id] = quantity
+        if returned:
+            try:
+                self.store.return_stock(returned)
+            except Exception as e:
+                print(f"Failed to return leased stock: {str(e)}")
+                for crop_id, quantity in returned.items():
+                    with self._lock(crop_id):
+                        self._held[crop_id] = self.held(crop_id) + quantity
+        return returned
+
+    def _return_loop(self):
+        intervals = [interval for interval in (self.demand_poll, self.idle_return / 2) if interval]
+        idle_checked = time.monotonic()
+        while not self._stop.wait(min(intervals)):
+            if self.demand_poll:
+                self.return_wanted()
+            if self.idle_return and time.monotonic() - idle_checked >= self.idle_return / 2:
+                idle_checked = time.monotonic()
+                self.return_idle()
+
+    def close(self):
+        """Stop the idle returner and give back everything still leased"""
+        self._stop.set()
+        return self.return_idle(idle_for=0)
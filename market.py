@@ -0,0 +1,127 @@
+import os
+from datetime import date, timedelta
+
+# Days covered by /api/market/prices when the request doesn't say
+MARKET_DAYS = int(os.getenv('MARKET_DAYS', 30))
+MARKET_MAX_DAYS = 366
+
+TOTALS = ('price_count', 'price_sum', 'traded_quantity', 'traded_value')
+
+
+class InvalidWindow(ValueError):
+    pass
+
+
+def window_start(days, today=None):
+    """First day of a window of `days` days ending today"""
+    if not 1 <= days <= MARKET_MAX_DAYS:
+        raise InvalidWindow(f'days must be between 1 and {MARKET_MAX_DAYS}')
+    return (today or date.today()) - timedelta(days=days - 1)
+
+
+def merge(into, row):
+    """Fold one aggregate row (a shard, or a whole day) into another"""
+    for column in TOTALS:
+        into[column] = into.get(column, 0) + float(row.get(column) or 0)
+    for column, pick in (('price_min', min), ('price_max', max)):
+        if row.get(column) is not None:
+            value = float(row[column])
+            into[column] = value if into.get(column) is None else pick(into[column], value)
+    return into
+
+
+def stats(row):
+    """min, max, mean and volume-weighted price plus traded quantity of an aggregate row"""
+    count, quantity = row.get('price_count') or 0, row.get('traded_quantity') or 0
+    return {
+        'min_price': row.get('price_min'),
+        'max_price': row.get('price_max'),
+        'mean_price': round(row['price_sum'] / count, 2) if count else None,
+        'vwap': round(row['traded_value'] / quantity, 2) if quantity else None,
+        'traded_quantity': quantity,
+        'price_points': int(count),
+    }
+
+
+def market_report(daily):
+    """Turn market_summary() rows into per-day and whole-window stats.
+
+    daily has one row of running totals per type, region and day, so the
+    work here depends on the window and the number of markets, never on how
+    many orders or price changes made up those totals.
+    """
+    days, window = [], {}
+    for row in daily:
+        days.append({'type': row['type'], 'region': row['region'], 'day': row['day'], **stats(merge({}, row))})
+        merge(window.setdefault((row['type'], row['region']), {}), row)
+    summary = [{'type': crop_type, 'region': region, **stats(totals)}
+               for (crop_type, region), totals in sorted(window.items())]
+    return days, summary
+
+
+def _add(table, crop_type, region, day, prices, quantity=0, value=0):
+    key = (crop_type, region, str(day))
+    # Today's rows are the newest, so look from the end
+    for row in reversed(table):
+        if (row['type'], row['region'], row['day']) == key:
+            break
+    else:
+        row = {'type': crop_type, 'region': region, 'day': str(day), 'shard': 0}
+        table.append(row)
+    merge(row, {'price_count': len(prices), 'price_sum': sum(prices), 'price_min': min(prices),
+                'price_max': max(prices), 'traded_quantity': quantity, 'traded_value': value})
+
+
+def record_listing(tables, crop, day=None):
+    """In-memory version of the crops trigger: count a listed or changed price"""
+    price = float(crop['price'])
+    _add(tables.setdefault('market_prices', []), crop['type'], crop['region'], day or date.today(), [price])
+
+
+def record_trades(tables, items, day=None):
+    """In-memory version of the order_items trigger: add one order's lines"""
+    crops = {crop['id']: crop for crop in tables.get('crops', [])}
+    markets = {}
+    for item in items:
+        crop = crops[item['crop_id']]
+        markets.setdefault((crop['type'], crop['region']), []).append(item)
+    for (crop_type, region), lines in sorted(markets.items()):
+        _add(tables.setdefault('market_prices', []), crop_type, region, day or date.today(),
+             [float(line['unit_price']) for line in lines],
+             sum(float(line['quantity']) for line in lines),
+             sum(float(line['total_price']) for line in lines))
+
+
+def backfill(tables, day=None):
+    """In-memory version of the init_db.sql backfill: market_prices from order history"""
+    crops = {crop['id']: crop for crop in tables.get('crops', [])}
+    orders = {order['id']: order for order in tables.get('orders', [])}
+    markets = {}
+    for item in tables.get('order_items', []):
+        crop = crops[item['crop_id']]
+        created_at = item.get('created_at') or orders[item['order_id']]['order_date']
+        key = (crop['type'], crop['region'], str(created_at)[:10])
+        price = float(item['unit_price'])
+        merge(markets.setdefault(key, {'type': key[0], 'region': key[1], 'day': key[2], 'shard': 0}), {
+            'price_count': 1, 'price_sum': price, 'price_min': price, 'price_max': price,
+            'traded_quantity': item['quantity'], 'traded_value': item['total_price']})
+    tables['market_prices'] = [markets[key] for key in sorted(markets, key=lambda key: key[2])]
+    for crop in crops.values():
+        record_listing(tables, crop, day)
+    return tables['market_prices']
+
+
+def market_summary(rows, since, crop_type=None, region=None):
+    """In-memory version of market_summary() in init_db.sql"""
+    daily = {}
+    for row in rows:
+        if str(row['day']) < str(since):
+            continue
+        if (crop_type and row['type'] != crop_type) or (region and row['region'] != region):
+            continue
+        key = (row['type'], row['region'], str(row['day']))
+        merge(daily.setdefault(key, {'type': key[0], 'region': key[1], 'day': key[2]}), row)
+    # Newest day first, like the SQL function
+    rows = sorted(daily.values(), key=lambda row: (row['type'], row['region']))
+    rows.sort(key=lambda row: row['day'], reverse=True)
+    return rows
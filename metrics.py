@@ -0,0 +1,196 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from flask import Response, g, request
+
+# Record timings and serve them on /metrics (Prometheus text format)
+METRICS_ENABLED = os.getenv('METRICS', '0') == '1'
+# Add a Server-Timing header to every response (works without METRICS)
+SERVER_TIMING = os.getenv('SERVER_TIMING', '0') == '1'
+ENABLED = METRICS_ENABLED or SERVER_TIMING
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+# Timings of the request being handled; copied into query pool threads
+_current = contextvars.ContextVar('request_timings', default=None)
+_disabled = nullcontext()
+
+
+class Histogram:
+    """Cumulative Prometheus histogram with one series per label tuple"""
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {values[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+request_seconds = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request', ('endpoint', 'method', 'status'))
+supabase_calls = Histogram(
+    'supabase_calls_per_request', 'Supabase round trips made by one request', ('endpoint',), COUNT_BUCKETS)
+stage_seconds = Histogram(
+    'stage_duration_seconds', 'Time spent in instrumented stages (supabase, knn, pdf, ...)', ('stage',))
+HISTOGRAMS = [request_seconds, supabase_calls, stage_seconds]
+
+
+class _Timer:
+    __slots__ = ('stage', 'started')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        if METRICS_ENABLED:
+            stage_seconds.observe(elapsed, self.stage)
+        timings = _current.get()
+        if timings is not None:
+            timings.append((self.stage, elapsed))  # list.append is atomic across pool threads
+        return False
+
+
+def timed(stage):
+    """Context manager timing one stage; a shared no-op when metrics are off"""
+    if not ENABLED:
+        return _disabled
+    return _Timer(stage)
+
+
+class _TimedQuery:
+    """Wraps a query builder so execute() is timed as a 'supabase' stage"""
+
+    __slots__ = ('_builder',)
+
+    def __init__(self, builder):
+        self._builder = builder
+
+    def execute(self):
+        with timed('supabase'):
+            return self._builder.execute()
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return _TimedQuery(result) if hasattr(result, 'execute') else result
+        return chained
+
+
+class TimedClient:
+    """Supabase client whose table() and rpc() queries are timed"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return _TimedQuery(self._client.table(name))
+
+    def rpc(self, name, params):
+        return _TimedQuery(self._client.rpc(name, params))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def instrument_client(client):
+    """Return client unchanged when metrics are off, else a timed wrapper"""
+    return TimedClient(client) if ENABLED else client
+
+
+def server_timing(timings, total):
+    """Server-Timing header value: summed duration per stage plus the total"""
+    stages = {}
+    for stage, elapsed in timings:
+        duration, count = stages.get(stage, (0.0, 0))
+        stages[stage] = (duration + elapsed, count + 1)
+    parts = [f'{stage};dur={duration * 1000:.1f};desc="{count}x"' for stage, (duration, count) in stages.items()]
+    parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def render():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app):
+    """Register the timing hooks and /metrics; does nothing when disabled"""
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def start_timing():
+        g.metrics_started = time.perf_counter()
+        g.metrics_token = _current.set([])
+
+    @app.after_request
+    def finish_timing(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        total = time.perf_counter() - started
+        timings = _current.get() or []
+        if METRICS_ENABLED:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            request_seconds.observe(total, endpoint, request.method, str(response.status_code))
+            supabase_calls.observe(sum(1 for stage, _ in timings if stage == 'supabase'), endpoint)
+        if SERVER_TIMING:
+            response.headers['Server-Timing'] = server_timing(timings, total)
+        return response
+
+    @app.teardown_request
+    def stop_timing(exc):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            _current.reset(token)
+
+    if METRICS_ENABLED:
+        @app.route('/metrics', methods=['GET'])
+        def metrics():
+            return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,163 @@
+import os
+import threading
+
+import numpy as np
+
+NEIGHBOR_TABLE_PATH = os.getenv('NEIGHBOR_TABLE_PATH', 'crop_neighbors.npz')
+NEIGHBOR_K = int(os.getenv('NEIGHBOR_K', 5))
+# Above this share of changed rows a full rebuild is cheaper than patching
+REBUILD_RATIO = 0.25
+# Upper bound on similarity matrix cells held at once while scanning
+BLOCK_CELLS = 1 << 24
+
+
+def normalize(features):
+    """Scale rows to unit length so a dot product is the cosine similarity"""
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return features / norms
+
+
+def top_k(similarity, k):
+    """Column indices and scores of the k best entries of each row, best first"""
+    k = min(k, similarity.shape[1])
+    if k == 0:
+        return np.empty((len(similarity), 0), dtype=np.int64), np.empty((len(similarity), 0))
+    cols = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    scores = np.take_along_axis(similarity, cols, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(cols, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+class NeighborTable:
+    """Precomputed top-K most similar crops for every crop in the catalog.
+
+    Rows are keyed by crop id and hold neighbour ids (-1 where there are
+    fewer than k other crops) with the cosine similarity of the vectors
+    extract_features returns, which should be the space the recommender
+    backend searches. sync() patches only the rows affected by changed crops
+    instead of rebuilding everything; a retrained model that moves every
+    vector rebuilds. Both take the catalog as a CatalogSnapshot (see catalog.py).
+    """
+
+    def __init__(self, extract_features, k=NEIGHBOR_K):
+        self.extract_features = extract_features
+        self.k = k
+        # (rows, ids, vectors, neighbor_ids, scores) is swapped as a whole on update
+        self._table = ({}, np.empty(0, dtype=np.int64), np.empty((0, 0)),
+                       np.empty((0, k), dtype=np.int64), np.empty((0, k)))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._table[1])
+
+    def __contains__(self, crop_id):
+        return crop_id in self._table[0]
+
+    def _neighbors_for(self, targets, vectors, ids, target_rows=None):
+        """Top-k neighbours of target vectors against the whole table, in blocks"""
+        neighbor_ids = np.full((len(targets), self.k), -1, dtype=np.int64)
+        scores = np.full((len(targets), self.k), -np.inf)
+        block = max(1, BLOCK_CELLS // max(len(vectors), 1))
+        for start in range(0, len(targets), block):
+            similarity = targets[start:start + block] @ vectors.T
+            if target_rows is not None:
+                # A crop is never its own neighbour
+                rows = target_rows[start:start + block]
+                similarity[np.arange(len(rows)), rows] = -np.inf
+            cols, best = top_k(similarity, self.k)
+            width = cols.shape[1]
+            neighbor_ids[start:start + block, :width] = ids[cols]
+            scores[start:start + block, :width] = best
+        neighbor_ids[~np.isfinite(scores)] = -1
+        return neighbor_ids, scores
+
+    def build(self, crops):
+        """Compute every crop's neighbours from scratch"""
+        ids = np.array(crops.ids, dtype=np.int64)
+        vectors = normalize(self.extract_features(crops)) if len(crops) else np.empty((0, 0))
+        neighbor_ids, scores = self._neighbors_for(vectors, vectors, ids, np.arange(len(ids)))
+        with self._lock:
+            self._table = ({crop_id: row for row, crop_id in enumerate(ids.tolist())},
+                           ids, vectors, neighbor_ids, scores)
+
+    def sync(self, crops):
+        """Bring the table in line with the catalog, patching only what changed"""
+        rows, ids, vectors, neighbor_ids, scores = self._table
+        if not len(ids) or not len(crops):
+            return self.build(crops)
+        new_vectors = normalize(self.extract_features(crops))
+        new_ids = np.array(crops.ids, dtype=np.int64)
+
+        # Which crops were added, edited or removed since the last sync
+        old_rows = np.array([rows.get(crop_id, -1) for crop_id in new_ids.tolist()])
+        existed = old_rows >= 0
+        changed = ~existed
+        changed[existed] = np.any(vectors[old_rows[existed]] != new_vectors[existed], axis=1)
+        removed = np.setdiff1d(ids, new_ids)
+        touched = np.concatenate([new_ids[changed], removed])
+        if len(touched) > REBUILD_RATIO * len(new_ids):
+            return self.build(crops)
+
+        # Carry over lists of unchanged crops into the new row order
+        next_ids = np.full((len(new_ids), self.k), -1, dtype=np.int64)
+        next_scores = np.full((len(new_ids), self.k), -np.inf)
+        next_ids[existed] = neighbor_ids[old_rows[existed]]
+        next_scores[existed] = scores[old_rows[existed]]
+
+        # Rows that lost a neighbour need a full rescan: their (k+1)th best is unknown
+        dirty = changed | np.isin(next_ids, touched).any(axis=1)
+        if dirty.any():
+            dirty_rows = np.flatnonzero(dirty)
+            next_ids[dirty_rows], next_scores[dirty_rows] = self._neighbors_for(
+                new_vectors[dirty_rows], new_vectors, new_ids, dirty_rows
+            )
+
+        # Clean rows keep their list unless an edited or new crop now beats it
+        clean_rows = np.flatnonzero(~dirty)
+        changed_rows = np.flatnonzero(changed)
+        if len(clean_rows) and len(changed_rows):
+            candidates = new_vectors[clean_rows] @ new_vectors[changed_rows].T
+            merged_scores = np.hstack([next_scores[clean_rows], candidates])
+            merged_ids = np.hstack([next_ids[clean_rows], np.broadcast_to(new_ids[changed_rows], candidates.shape)])
+            cols, best = top_k(merged_scores, self.k)
+            next_ids[clean_rows] = np.take_along_axis(merged_ids, cols, axis=1)
+            next_scores[clean_rows] = best
+            next_ids[~np.isfinite(next_scores)] = -1
+
+        with self._lock:
+            self._table = ({crop_id: row for row, crop_id in enumerate(new_ids.tolist())},
+                           new_ids, new_vectors, next_ids, next_scores)
+
+    def lookup(self, crop_ids):
+        """Return (known mask, neighbour ids, scores) for the given crop ids"""
+        rows, _, _, neighbor_ids, scores = self._table
+        positions = np.array([rows.get(crop_id, -1) for crop_id in crop_ids], dtype=np.int64)
+        known = positions >= 0
+        return known, neighbor_ids[positions[known]], scores[positions[known]]
+
+    def save(self, path=NEIGHBOR_TABLE_PATH):
+        _, ids, vectors, neighbor_ids, scores = self._table
+        tmp_path = f'{path}.tmp.npz'
+        np.savez_compressed(tmp_path, ids=ids, vectors=vectors, neighbor_ids=neighbor_ids, scores=scores)
+        os.replace(tmp_path, path)
+
+    def load(self, path=NEIGHBOR_TABLE_PATH):
+        """Load a saved table; crop rows are filled in by the next sync()"""
+        with np.load(path) as data:
+            ids = data['ids']
+            if data['neighbor_ids'].shape[1] != self.k:
+                raise ValueError(f"Table was built with k={data['neighbor_ids'].shape[1]}, expected {self.k}")
+            with self._lock:
+                self._table = ({crop_id: row for row, crop_id in enumerate(ids.tolist())},
+                               ids, data['vectors'], data['neighbor_ids'], data['scores'])
+
+
+if __name__ == '__main__':
+    # Offline stage: python neighbor_table.py
+    from ai_service import neighbor_table as table, recommender, supabase
+
+    # Loading the model syncs the table to it, in the backend's feature space
+    recommender.get(supabase)
+    table.save()
+    print(f"Saved top-{table.k} neighbours for {len(table)} crops to {NEIGHBOR_TABLE_PATH}")
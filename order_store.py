@@ -0,0 +1,292 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+
+from market import record_trades
+
+# Where create_order writes: supabase (RPC), postgres (DATABASE_URL) or memory
+ORDER_STORE = os.getenv('ORDER_STORE', 'supabase')
+DATABASE_URL = os.getenv('DATABASE_URL')
+# How long a shortfall keeps a crop wanted (the interval in init_db.sql)
+STOCK_WANTED_SECONDS = 5
+
+
+class OrderStoreError(Exception):
+    pass
+
+
+class InsufficientStock(OrderStoreError):
+    """An order asked for more of a crop than is in stock; nothing was written"""
+
+    def __init__(self, crop_id):
+        super().__init__(f'Not enough stock for crop {crop_id}')
+        self.crop_id = crop_id
+
+
+def stock_rows(quantities, extra=None):
+    """{crop_id: quantity} -> the [{'crop_id', 'quantity'}] rows the stock functions take"""
+    rows = [{'crop_id': crop_id, 'quantity': float(quantity)} for crop_id, quantity in quantities.items()]
+    if extra:
+        for row in rows:
+            row['extra'] = float(extra.get(row['crop_id'], 0))
+    return rows
+
+
+def lease_rows(granted):
+    """lease_stock() result rows -> {crop_id: (granted, leased by all servers)}"""
+    return {row['id']: (row['quantity'], row['leased']) for row in granted}
+
+
+def group_items(orders, items):
+    """Attach items to their orders as order['items'], keeping item order"""
+    by_order = {order['id']: [] for order in orders}
+    for item in items:
+        by_order[item['order_id']].append(item)
+    for order in orders:
+        order['items'] = by_order[order['id']]
+    return orders
+
+
+class SupabaseOrderStore:
+    """Calls the create_order() function from init_db.sql through PostgREST.
+
+    The order, all of its items and the stock decrements are one round trip
+    and one transaction: either everything is written or nothing is.
+    """
+
+    # Orders come back with their items (and crop details) embedded in one request
+    order_columns = '*, items:order_items(*, crops(name, type, region))'
+
+    def __init__(self, client):
+        self.client = client
+
+    def attach_items(self, orders):
+        return orders
+
+    def create(self, order, items, reserved=False):
+        """Write the order; returns [{'id', 'quantity'}] of the updated crops.
+
+        Raises InsufficientStock instead of overselling. With reserved=True
+        the stock was already leased (see inventory.py) and is left alone.
+        """
+        from postgrest.exceptions import APIError
+
+        params = {'p_order': order, 'p_items': items, 'p_reserved': reserved}
+        try:
+            return self.client.rpc('create_order', params).execute().data
+        except APIError as e:
+            if e.message == 'insufficient_stock':
+                raise InsufficientStock(int(e.details)) from e
+            raise
+
+    def lease_stock(self, quantities, extra=None, share=1):
+        """Take up to {crop_id: quantity} out of stock, plus up to extra[crop_id]
+        capped at `share` of what is left; returns {crop_id: (granted, leased)}
+        where leased is what all servers now hold of the crop.
+        """
+        params = {'p_requests': stock_rows(quantities, extra), 'p_share': float(share)}
+        return lease_rows(self.client.rpc('lease_stock', params).execute().data)
+
+    def return_stock(self, quantities):
+        self.client.rpc('return_stock', {'p_returns': stock_rows(quantities)}).execute()
+
+    def wanted_stock(self, crop_ids):
+        """The crops among crop_ids that a server recently came up short of"""
+        return set(self.client.rpc('wanted_stock', {'p_crop_ids': list(crop_ids)}).execute().data)
+
+
+class PostgresOrderStore:
+    """Same create_order() call over a direct connection pool (psycopg2)"""
+
+    order_columns = '*'
+
+    def __init__(self, dsn, max_connections=10):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self.pool = ThreadedConnectionPool(1, max_connections, dsn)
+        # The pool raises instead of waiting when it is empty; callers queue here
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            conn = self.pool.getconn()
+            try:
+                yield conn
+            finally:
+                self.pool.putconn(conn)
+
+    def attach_items(self, orders):
+        """Load the items of a page of orders with one IN query"""
+        if not orders:
+            return orders
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    # Rows as JSON so numbers and timestamps match what PostgREST returns
+                    cur.execute(
+                        """
+                        SELECT to_jsonb(oi) || jsonb_build_object(
+                            'crops', jsonb_build_object('name', c.name, 'type', c.type, 'region', c.region))
+                        FROM order_items oi
+                        JOIN crops c ON c.id = oi.crop_id
+                        WHERE oi.order_id = ANY(%s::uuid[])
+                        ORDER BY oi.id
+                        """,
+                        ([order['id'] for order in orders],)
+                    )
+                    items = [row[0] for row in cur.fetchall()]
+        return group_items(orders, items)
+
+    def _call(self, sql, *params):
+        with self.connection() as conn:
+            with conn:  # Commits on success, rolls back on error
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    return cur.fetchone()[0]
+
+    def create(self, order, items, reserved=False):
+        from psycopg2 import errors
+
+        try:
+            return self._call('SELECT create_order(%s::jsonb, %s::jsonb, %s)', json.dumps(order), json.dumps(items), reserved)
+        except errors.RaiseException as e:
+            if e.diag.message_primary == 'insufficient_stock':
+                raise InsufficientStock(int(e.diag.message_detail)) from e
+            raise
+
+    def lease_stock(self, quantities, extra=None, share=1):
+        granted = self._call('SELECT lease_stock(%s::jsonb, %s)', json.dumps(stock_rows(quantities, extra)), share)
+        return lease_rows(granted)
+
+    def return_stock(self, quantities):
+        self._call('SELECT return_stock(%s::jsonb)', json.dumps(stock_rows(quantities)))
+
+    def wanted_stock(self, crop_ids):
+        return set(self._call('SELECT wanted_stock(%s::jsonb)', json.dumps(list(crop_ids))))
+
+
+class MemoryOrderStore:
+    """In-memory stand-in with the same all-or-nothing semantics.
+
+    tables maps table names to lists of row dicts, e.g. a local fixture or
+    the benchmark's fake Supabase tables.
+    """
+
+    order_columns = '*'
+
+    def __init__(self, tables):
+        self.tables = tables
+        self._lock = threading.Lock()
+
+    def attach_items(self, orders):
+        ids = {order['id'] for order in orders}
+        crops = {crop['id']: crop for crop in self.tables.get('crops', [])}
+        items = []
+        for item in self.tables.get('order_items', []):
+            if item['order_id'] in ids:
+                crop = crops.get(item['crop_id'], {})
+                details = {key: crop.get(key) for key in ('name', 'type', 'region')}
+                items.append({**item, 'crops': details})
+        return group_items(orders, items)
+
+    def create(self, order, items, reserved=False):
+        with self._lock:
+            crops = {crop['id']: crop for crop in self.tables.setdefault('crops', [])}
+            ordered = {}
+            for item in items:
+                if item['crop_id'] not in crops:
+                    raise OrderStoreError(f"Crop {item['crop_id']} does not exist")
+                ordered[item['crop_id']] = ordered.get(item['crop_id'], 0) + Decimal(str(item['quantity']))
+            if not reserved:
+                for crop_id, quantity in ordered.items():
+                    if Decimal(str(crops[crop_id]['quantity'])) < quantity:
+                        raise InsufficientStock(crop_id)
+
+            # Nothing has been touched yet, so a failure above leaves no trace
+            self.tables.setdefault('orders', []).append(dict(order))
+            order_items = self.tables.setdefault('order_items', [])
+            next_id = max((row['id'] for row in order_items), default=0) + 1
+            for offset, item in enumerate(items):
+                order_items.append({'id': next_id + offset, 'order_id': order['id'], **item})
+            # What the order_items trigger does in the database
+            record_trades(self.tables, items)
+            if reserved:
+                leases = self._leases()
+                for crop_id, quantity in ordered.items():
+                    if crop_id in leases:
+                        leases[crop_id]['quantity'] = max(leases[crop_id]['quantity'] - quantity, Decimal(0))
+                return []
+            return self._adjust({crop_id: -quantity for crop_id, quantity in ordered.items()})
+
+    def _adjust(self, changes):
+        crops = {crop['id']: crop for crop in self.tables.setdefault('crops', [])}
+        updated = []
+        for crop_id, change in changes.items():
+            crop = crops[crop_id]
+            crop['quantity'] = float(Decimal(str(crop['quantity'])) + Decimal(str(change)))
+            crop['updated_at'] = datetime.now().isoformat()  # The crops_touch_updated_at trigger
+            updated.append({'id': crop_id, 'quantity': crop['quantity']})
+        return updated
+
+    def _leases(self):
+        """The stock_leases rows by crop id"""
+        return {lease['crop_id']: lease for lease in self.tables.setdefault('stock_leases', [])}
+
+    def _wanted(self, lease, now):
+        return lease is not None and now - lease['wanted_at'] < STOCK_WANTED_SECONDS
+
+    def lease_stock(self, quantities, extra=None, share=1):
+        with self._lock:
+            crops = {crop['id']: crop for crop in self.tables.setdefault('crops', [])}
+            leases = self._leases()
+            now = time.time()
+            granted = {}
+            for crop_id, quantity in quantities.items():
+                if crop_id not in crops:
+                    continue
+                needed = Decimal(str(quantity))
+                stock = max(Decimal(str(crops[crop_id]['quantity'])), Decimal(0))
+                more = Decimal(0) if self._wanted(leases.get(crop_id), now) else Decimal(str((extra or {}).get(crop_id, 0)))
+                granted[crop_id] = min(needed, stock) + min(more, (max(stock - needed, Decimal(0)) * Decimal(str(share))) // 1)
+                lease = leases.get(crop_id)
+                if lease is None:
+                    lease = leases[crop_id] = {'crop_id': crop_id, 'quantity': Decimal(0), 'wanted_at': float('-inf')}
+                    self.tables['stock_leases'].append(lease)
+                lease['quantity'] += granted[crop_id]
+                if granted[crop_id] < needed:
+                    lease['wanted_at'] = now
+            self._adjust({crop_id: -quantity for crop_id, quantity in granted.items() if quantity > 0})
+            return {crop_id: (float(quantity), float(leases[crop_id]['quantity'])) for crop_id, quantity in granted.items()}
+
+    def return_stock(self, quantities):
+        with self._lock:
+            crops = {crop['id'] for crop in self.tables.setdefault('crops', [])}
+            leases = self._leases()
+            for crop_id, quantity in quantities.items():
+                if crop_id in leases:
+                    leases[crop_id]['quantity'] = max(leases[crop_id]['quantity'] - Decimal(str(quantity)), Decimal(0))
+            self._adjust({crop_id: quantity for crop_id, quantity in quantities.items() if crop_id in crops})
+
+    def wanted_stock(self, crop_ids):
+        with self._lock:
+            leases = self._leases()
+            now = time.time()
+            return {crop_id for crop_id in crop_ids if self._wanted(leases.get(crop_id), now)}
+
+
+def make_order_store(client, name=None):
+    name = name or ORDER_STORE
+    if name == 'supabase':
+        return SupabaseOrderStore(client)
+    if name == 'postgres':
+        if not DATABASE_URL:
+            raise OrderStoreError('ORDER_STORE=postgres needs DATABASE_URL')
+        return PostgresOrderStore(DATABASE_URL)
+    if name == 'memory':
+        return MemoryOrderStore({})
+    raise OrderStoreError(f"Unknown order store '{name}'")
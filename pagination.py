@@ -0,0 +1,44 @@
+import base64
+import json
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Opaque cursor for the sort key of the last row on a page"""
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    """Inverse of encode_cursor; raises InvalidCursor for anything malformed.
+
+    types lists the expected type of each value, e.g. (str, str) for
+    (order_date, id), so a tampered cursor never reaches a query.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+    if not isinstance(values, list) or len(values) != len(types):
+        raise InvalidCursor('Invalid cursor')
+    # bool is an int subclass, but never a valid id
+    if any(isinstance(value, bool) or not isinstance(value, kind) for value, kind in zip(values, types)):
+        raise InvalidCursor('Invalid cursor')
+    return values
+
+
+def quote(value):
+    """Quote a value for a PostgREST or=() filter (timestamps contain ':' and '.')"""
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def split_page(rows, per_page, key):
+    """Trim a per_page + 1 fetch and return (page, next cursor or None)"""
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    return rows, encode_cursor(key(rows[-1]))
@@ -0,0 +1,239 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from catalog import CATALOG_SNAPSHOT_DIR, CatalogSnapshot, publish
+from export_stream import iter_batches
+from metrics import timed
+
+# How often (in seconds) the engine asks Supabase whether the catalog changed
+CATALOG_CHECK_INTERVAL = float(os.getenv('CATALOG_CHECK_INTERVAL', 5))
+# Retrain on a background thread once a model is being served
+RETRAIN_IN_BACKGROUND = os.getenv('RETRAIN_IN_BACKGROUND', '1') == '1'
+# Columns orders change; edits to only these are patched into the catalog
+STOCK_COLUMNS = ('quantity', 'updated_at')
+# Above this many changed rows the catalog is fetched again instead of patched
+STOCK_PATCH_ROWS = int(os.getenv('STOCK_PATCH_ROWS', 500))
+
+
+def catalog_version(supabase):
+    """Cheap fingerprint of the crops table: row count plus latest updated_at"""
+    count = supabase.table('crops').select('id', count='exact').limit(1).execute().count
+    latest = supabase.table('crops').select('updated_at').order('updated_at', desc=True).limit(1).execute().data
+    return (count, latest[0]['updated_at'] if latest else None)
+
+
+def fetch_catalog(supabase):
+    """Every crop row in id order, read in keyset batches under PostgREST's row cap"""
+    return [crop for crops in iter_batches(supabase, 'crops') for crop in crops]
+
+
+def catalog_fingerprint(crops):
+    """Content hash of the rows and feature columns the model is fitted on.
+
+    Stock is left out: it moves with every order, and retraining for it
+    would refit the whole catalog each time. Stock changes reach the
+    catalog through CatalogSnapshot.patch instead.
+    """
+    digest = hashlib.sha1()
+    for crop in crops:
+        digest.update(repr((crop['id'], crop['name'], crop['type'], crop['price'])).encode())
+    return digest.hexdigest()
+
+
+def save_artifact(path, artifact):
+    """Write a model artifact atomically so readers never load a half-written file"""
+    import joblib
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        joblib.dump(artifact, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class RecommenderEngine:
+    """Keeps the fitted model and the crop catalog resident between requests.
+
+    The catalog is only fetched again when catalog_version() reports a change,
+    and is held as a CatalogSnapshot mapped from snapshot_dir (see catalog.py).
+    When the only rows changed since the last check differ in stock, they are
+    patched into the resident catalog instead of fetching and writing a new one.
+    Models are persisted as artifacts stamped with the catalog fingerprint and
+    the crop ids they index, so a saved model is only reused for the catalog
+    it was fitted on. After the first load, retraining happens on a background
+    thread and requests keep using the previous snapshot until it is swapped.
+    """
+
+    def __init__(self, train_model, model_path='crop_model.joblib', check_interval=CATALOG_CHECK_INTERVAL,
+                 background=RETRAIN_IN_BACKGROUND, tag=None, snapshot_dir=CATALOG_SNAPSHOT_DIR):
+        self.train_model = train_model
+        # Artifacts from another trainer or backend configuration are never reused
+        self.trainer = f'{train_model.__module__}.{train_model.__qualname__}'
+        if tag:
+            self.trainer = f'{self.trainer}:{tag}'
+        self.model_path = model_path
+        self.snapshot_dir = snapshot_dir
+        self.check_interval = check_interval
+        self.background = background
+        self.version = None
+        self.fingerprint = None
+        # (model, catalog, crop_ids) is replaced as a whole so readers never see a mix
+        empty = CatalogSnapshot.from_rows([])
+        self.snapshot = (None, empty, empty.ids)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._retrain_thread = None
+        # Called with the catalog whenever a snapshot is swapped in or stock is patched
+        self.listeners = []
+
+    def _load_artifact(self, fingerprint):
+        import joblib
+
+        try:
+            with timed('model_load'):
+                artifact = joblib.load(self.model_path)
+        except Exception:
+            return None
+        # Older bare-model files and artifacts for another catalog are ignored
+        if not isinstance(artifact, dict):
+            return None
+        if artifact.get('fingerprint') != fingerprint or artifact.get('trainer') != self.trainer:
+            return None
+        return artifact['model']
+
+    def _build(self, crops, fingerprint):
+        model = self._load_artifact(fingerprint)
+        if model is None:
+            with timed('model_train'):
+                model = self.train_model(crops)
+            try:
+                save_artifact(self.model_path, {
+                    'model': model,
+                    'fingerprint': fingerprint,
+                    'trainer': self.trainer,
+                    'crop_ids': crops.ids.tolist(),
+                    'trained_at': datetime.now().isoformat(),
+                })
+            except Exception as e:
+                print(f"Failed to save model artifact: {str(e)}")
+        return model
+
+    def _patch_stock(self, supabase, version):
+        """Patch rows changed since the last version if only their stock moved.
+
+        Returns False when a full reload is needed: rows were added or
+        removed, too many changed, or a change touched any other column.
+        """
+        _, catalog, _ = self.snapshot
+        if self.version is None or self.version[1] is None or version[0] != self.version[0]:
+            return False
+        # gte: rows stamped in the same instant as the last check may be new
+        rows = supabase.table('crops').select('*').gte('updated_at', self.version[1]
+            ).order('id').limit(STOCK_PATCH_ROWS + 1).execute().data
+        if len(rows) > STOCK_PATCH_ROWS:
+            return False
+        for row in rows:
+            current = catalog.get(row['id'])
+            if current is None or any(current.get(column) != value
+                                      for column, value in row.items() if column not in STOCK_COLUMNS):
+                return False
+        for row in rows:
+            catalog.patch(row['id'], {column: row[column] for column in STOCK_COLUMNS if column in row})
+        return True
+
+    def reload(self, supabase, version=None):
+        """Fetch the catalog and swap in a model fitted on exactly those rows"""
+        with self._lock:
+            if version is None:
+                version = catalog_version(supabase)
+            if self._patch_stock(supabase, version):
+                self.version = version
+                for listener in self.listeners:
+                    listener(self.snapshot[1])
+                return
+            crops = fetch_catalog(supabase)
+            fingerprint = catalog_fingerprint(crops)
+            # The row dicts are dropped once the columnar snapshot is built
+            catalog = publish(crops, self.snapshot_dir)
+            del crops
+            # Edits to columns the model ignores (description, region, ...) keep the model
+            if fingerprint != self.fingerprint or self.snapshot[0] is None:
+                model = self._build(catalog, fingerprint)
+                self.fingerprint = fingerprint
+            else:
+                model = self.snapshot[0]
+            self.snapshot = (model, catalog, catalog.ids)
+            self.version = version
+            for listener in self.listeners:
+                listener(catalog)
+
+    def _reload_quietly(self, supabase, version):
+        try:
+            self.reload(supabase, version)
+        except Exception as e:
+            print(f"Background retrain failed: {str(e)}")
+
+    def retrain_in_background(self, supabase, version=None):
+        """Start a retrain unless one is already running; returns the thread"""
+        if self._retrain_thread is not None and self._retrain_thread.is_alive():
+            return self._retrain_thread
+        self._retrain_thread = threading.Thread(
+            target=self._reload_quietly, args=(supabase, version), daemon=True
+        )
+        self._retrain_thread.start()
+        return self._retrain_thread
+
+    def get(self, supabase):
+        """Return (model, catalog, crop_ids), reloading only if the catalog version moved"""
+        now = time.monotonic()
+        loaded = self.snapshot[0] is not None
+        if not loaded or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            version = catalog_version(supabase)
+            if not loaded:
+                self.reload(supabase, version)
+            elif version != self.version:
+                if self.background:
+                    self.retrain_in_background(supabase, version)
+                else:
+                    self.reload(supabase, version)
+        return self.snapshot
+
+
+def exclude_own_ids(similarity, neighbor_ids, items):
+    """Mask out neighbours that are the querying cart item itself"""
+    item_ids = np.array([item.get('id') for item in items], dtype=object)
+    similarity = similarity.copy()
+    similarity[neighbor_ids == item_ids[:, None]] = -np.inf
+    return similarity
+
+
+def rank_neighbors(similarity, keys, limit, sort=True):
+    """Merge the neighbour rows of one cart into a de-duplicated ranking.
+
+    keys are catalog positions or crop ids; returns (keys, scores). With
+    sort=False the order in which neighbours were first seen is kept instead
+    of ranking by score.
+    """
+    scores = similarity.ravel()
+    positions = keys.ravel()
+    keep = np.isfinite(scores)
+    scores, positions = scores[keep], positions[keep]
+    if sort:
+        order = np.argsort(-scores, kind='stable')
+        scores, positions = scores[order], positions[order]
+    # First occurrence of each crop is its best score once sorted
+    _, first = np.unique(positions, return_index=True)
+    first.sort()
+    first = first[:limit]
+    return positions[first], scores[first]
@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+
+from neighbor_table import normalize
+
+# scikit-learn is imported inside fit(): it is by far the slowest import and
+# only needed once a model is trained (unpickling a model imports it too)
+
+# Which nearest-neighbour index the recommender fits: brute, ball_tree or ivf
+RECOMMENDER_BACKEND = os.getenv('RECOMMENDER_BACKEND', 'brute')
+
+
+class BruteForceBackend:
+    """Exact cosine search over the raw features (the original model)"""
+
+    name = 'brute'
+
+    def __init__(self, n_neighbors=5):
+        self.n_neighbors = n_neighbors
+
+    def fit(self, X):
+        from sklearn.neighbors import NearestNeighbors
+
+        self.model = NearestNeighbors(n_neighbors=self.n_neighbors, metric='cosine', algorithm='brute')
+        self.model.fit(X)
+        self.n_samples_fit_ = len(X)
+        return self
+
+    def query(self, X, n_neighbors=None):
+        """Return (similarity, indices), best match first"""
+        distances, indices = self.model.kneighbors(X, n_neighbors=n_neighbors or self.n_neighbors)
+        return 1 - distances, indices
+
+
+class StandardizedBackend:
+    """Base for indexes over standardized, unit-length feature vectors.
+
+    Standardizing stops price and quantity from drowning out the type flags;
+    on unit vectors the euclidean distance orders results exactly like cosine.
+    """
+
+    name = None
+
+    def __init__(self, n_neighbors=5):
+        self.n_neighbors = n_neighbors
+
+    def prepare(self, X):
+        return normalize(self.scaler.transform(np.asarray(X, dtype=float)))
+
+    def fit(self, X):
+        from sklearn.preprocessing import StandardScaler
+
+        self.scaler = StandardScaler().fit(X)
+        self.n_samples_fit_ = len(X)
+        self.build(self.prepare(X))
+        return self
+
+
+class BallTreeBackend(StandardizedBackend):
+    """Exact search with a ball tree; sub-linear query time on large catalogs"""
+
+    name = 'ball_tree'
+
+    def build(self, vectors):
+        from sklearn.neighbors import BallTree
+
+        self.tree = BallTree(vectors)
+
+    def query(self, X, n_neighbors=None):
+        distances, indices = self.tree.query(self.prepare(X), k=min(n_neighbors or self.n_neighbors, self.n_samples_fit_))
+        # |a - b|^2 = 2 - 2 cos(a, b) for unit vectors
+        return 1 - distances ** 2 / 2, indices
+
+
+class IVFBackend(StandardizedBackend):
+    """Approximate inverted-file index: k-means cells, only n_probe cells scanned.
+
+    Query cost grows with catalog size / n_lists * n_probe instead of the full
+    catalog, at the price of occasionally missing a neighbour in an unprobed cell.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, n_neighbors=5, n_lists=None, n_probe=8):
+        super().__init__(n_neighbors)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+
+    def build(self, vectors):
+        from sklearn.cluster import MiniBatchKMeans
+
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, n_init=3, random_state=0)
+        labels = kmeans.fit_predict(vectors)
+        self.centroids = normalize(kmeans.cluster_centers_)
+        # Rows sorted by cell so each inverted list is a contiguous slice
+        order = np.argsort(labels, kind='stable')
+        self.rows = order
+        self.vectors = vectors[order]
+        self.offsets = np.searchsorted(labels[order], np.arange(n_lists + 1))
+
+    def query(self, X, n_neighbors=None):
+        k = min(n_neighbors or self.n_neighbors, self.n_samples_fit_)
+        queries = self.prepare(X)
+        n_probe = min(self.n_probe, len(self.centroids))
+        cells = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :n_probe]
+        similarity = np.full((len(queries), k), -np.inf)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, probe) in enumerate(zip(queries, cells)):
+            candidates = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+            scores = self.vectors[candidates] @ query
+            best = np.argsort(-scores, kind='stable')[:k]
+            similarity[row, :len(best)] = scores[best]
+            indices[row, :len(best)] = self.rows[candidates[best]]
+        return similarity, indices
+
+
+BACKENDS = {backend.name: backend for backend in (BruteForceBackend, BallTreeBackend, IVFBackend)}
+
+
+def make_backend(name=None, **options):
+    """Instantiate a recommender backend by name (default: RECOMMENDER_BACKEND)"""
+    name = name or RECOMMENDER_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown recommender backend '{name}', expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](**options)
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Modules live at the repository root, next to ai_service.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ai_service connects a client at import; tests swap in stand-ins
+os.environ.setdefault('SUPABASE_URL', 'http://localhost')
+os.environ.setdefault('SUPABASE_KEY', 'test')
+# Keep model artifacts and catalog snapshots out of the working tree
+os.environ.setdefault('CATALOG_SNAPSHOT_DIR', os.path.join(tempfile.mkdtemp(), 'catalog_snapshots'))
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from cache import LRUCache, SingleFlight
+from order_store import InsufficientStock, MemoryOrderStore, OrderStoreError
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # 'b' is now the oldest
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.evictions == 1
+
+
+def test_ttl_expires_entries():
+    cache = LRUCache(ttl=0.05)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_invalidate_tags_drops_only_tagged_entries():
+    cache = LRUCache()
+    cache.set('page1', 'x', tags=[1, 2])
+    cache.set('page2', 'y', tags=[3])
+    cache.invalidate_tags([2])
+    assert cache.get('page1') is None
+    assert cache.get('page2') == 'y'
+    assert cache.invalidations == 1
+
+
+def test_set_skipped_after_invalidation_since_generation():
+    cache = LRUCache()
+    generation = cache.generation
+    cache.invalidate_tags([1])  # A write lands while the value is being read
+    assert cache.set('page', 'stale', tags=[1], generation=generation) is False
+    assert cache.get('page') is None
+    assert cache.set('page', 'fresh', tags=[1], generation=cache.generation) is True
+
+
+def test_clear_bumps_generation():
+    cache = LRUCache()
+    generation = cache.generation
+    cache.set('a', 1)
+    cache.clear()
+    assert cache.get('a') is None
+    assert cache.set('a', 1, generation=generation) is False
+
+
+def test_max_bytes_bounds_total_weight():
+    cache = LRUCache(maxsize=10, max_bytes=10)
+    cache.set('a', b'12345')
+    cache.set('b', b'12345')
+    cache.set('c', b'123')
+    assert cache.get('a') is None
+    assert cache.bytes == 8
+    assert cache.set('big', b'x' * 11) is False
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do('cart', compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do('cart', compute))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flights.coalesced < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert results == ['result'] * 4
+    assert len(calls) == 1
+
+
+def test_single_flight_shares_exceptions_and_forgets_the_key():
+    flights = SingleFlight()
+
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        flights.do('cart', fail)
+    assert flights.do('cart', lambda: 'again') == 'again'
+
+
+def memory_store():
+    return MemoryOrderStore({'crops': [
+        {'id': 1, 'name': 'Tomato', 'type': 'vegetable', 'region': 'Dhaka', 'price': 10.0, 'quantity': 5.0},
+        {'id': 2, 'name': 'Mango', 'type': 'fruit', 'region': 'Rajshahi', 'price': 5.0, 'quantity': 1.0},
+    ]})
+
+
+def test_memory_store_creates_order_items_and_stock_together():
+    store = memory_store()
+    updated = store.create({'id': 'o1', 'user_id': 1}, [
+        {'crop_id': 1, 'quantity': 2, 'unit_price': 10, 'total_price': 20},
+        {'crop_id': 2, 'quantity': 1, 'unit_price': 5, 'total_price': 5},
+    ])
+    assert sorted((crop['id'], crop['quantity']) for crop in updated) == [(1, 3.0), (2, 0.0)]
+    assert [item['order_id'] for item in store.tables['order_items']] == ['o1', 'o1']
+
+
+@pytest.mark.parametrize('items, error', [
+    ([{'crop_id': 1, 'quantity': 2}, {'crop_id': 2, 'quantity': 2}], InsufficientStock),
+    ([{'crop_id': 1, 'quantity': 2}, {'crop_id': 9, 'quantity': 1}], OrderStoreError),
+])
+def test_memory_store_failed_order_leaves_no_trace(items, error):
+    store = memory_store()
+    with pytest.raises(error):
+        store.create({'id': 'o1', 'user_id': 1}, items)
+    assert store.tables['crops'][0]['quantity'] == 5.0
+    assert not store.tables.get('orders') and not store.tables.get('order_items')
@@ -0,0 +1,85 @@
+from email.message import EmailMessage
+
+from email_queue import EmailQueue
+
+
+class FlakySMTP:
+    """SMTP stand-in failing the first `failures` sends of each subject"""
+
+    failures = {}
+    attempts = {}
+    connections = 0
+
+    def __init__(self, host, port, timeout=None):
+        FlakySMTP.connections += 1
+
+    def send_message(self, msg):
+        subject = msg['Subject']
+        FlakySMTP.attempts[subject] = FlakySMTP.attempts.get(subject, 0) + 1
+        if FlakySMTP.attempts[subject] <= FlakySMTP.failures.get(subject, 0):
+            raise OSError('connection dropped')
+
+    def noop(self):
+        return (250, b'OK')
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def message(subject):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    return msg
+
+
+def make_queue(failures, **options):
+    FlakySMTP.failures = failures
+    FlakySMTP.attempts = {}
+    FlakySMTP.connections = 0
+    return EmailQueue('localhost', 25, starttls=False, backoff=0.01, smtp_class=FlakySMTP, **options)
+
+
+def test_sends_over_one_connection():
+    queue = make_queue({})
+    for i in range(5):
+        queue.enqueue(message(f'order {i}'))
+    assert queue.flush(5)
+    queue.close()
+    assert (queue.sent, queue.retried, queue.failed) == (5, 0, 0)
+    assert FlakySMTP.connections == 1
+
+
+def test_retries_with_backoff_then_sends():
+    queue = make_queue({'order': 2}, max_retries=3)
+    queue.enqueue(message('order'))
+    assert queue.flush(5)
+    queue.close()
+    assert (queue.sent, queue.retried, queue.failed) == (1, 2, 0)
+    assert FlakySMTP.attempts['order'] == 3
+    # A dropped connection is replaced for the retry
+    assert FlakySMTP.connections == 3
+
+
+def test_gives_up_after_max_retries():
+    queue = make_queue({'bad': 99}, max_retries=2)
+    queue.enqueue(message('bad'))
+    queue.enqueue(message('good'))
+    assert queue.flush(5)
+    queue.close()
+    assert (queue.sent, queue.retried, queue.failed) == (1, 2, 1)
+    assert FlakySMTP.attempts['bad'] == 3
+
+
+def test_counts_add_up_across_workers():
+    failures = {f'order {i}': i % 3 for i in range(60)}
+    queue = make_queue(failures, workers=4, max_retries=1)
+    for subject in failures:
+        queue.enqueue(message(subject))
+    assert queue.flush(10)
+    queue.close()
+    assert queue.sent + queue.failed == 60
+    assert queue.failed == sum(1 for count in failures.values() if count > 1)
+    assert queue.retried == sum(1 for count in failures.values() if count > 0)
@@ -0,0 +1,142 @@
+import time
+
+import pytest
+
+from inventory import InventoryEngine
+from order_store import InsufficientStock, MemoryOrderStore
+
+
+def make_store(*stock):
+    return MemoryOrderStore({'crops': [
+        {'id': crop_id, 'name': f'Crop {crop_id}', 'type': 'vegetable', 'region': 'Dhaka', 'price': 10.0,
+         'quantity': float(quantity)}
+        for crop_id, quantity in enumerate(stock, start=1)
+    ]})
+
+
+def make_engine(store, **options):
+    # No background returner unless a test asks for one
+    settings = {'lease_size': 10, 'lease_share': 1, 'idle_return': 0, 'demand_poll': 0, 'claim_wait': 0,
+                'sold_out_ttl': 0}
+    return InventoryEngine(store, **{**settings, **options})
+
+
+def stock(store, crop_id):
+    return next(crop['quantity'] for crop in store.tables['crops'] if crop['id'] == crop_id)
+
+
+def items(**quantities):
+    return [{'crop_id': int(crop_id[1:]), 'quantity': quantity} for crop_id, quantity in quantities.items()]
+
+
+def test_reserve_leases_a_block_and_reuses_it():
+    store = make_store(100)
+    engine = make_engine(store)
+    engine.reserve(items(c1=2))
+    assert stock(store, 1) == 88  # 2 for the order plus a block of 10
+    assert engine.held(1) == 10
+    engine.reserve(items(c1=3))
+    assert engine.leases == 1
+    assert engine.held(1) == 7
+
+
+def test_lease_is_capped_by_share_of_remaining_stock():
+    store = make_store(100)
+    engine = make_engine(store, lease_size=50, lease_share='0.1')
+    engine.reserve(items(c1=2))
+    # floor((100 - 2) * 0.1) = 9 extra rather than 50
+    assert engine.held(1) == 9
+    assert stock(store, 1) == 89
+
+
+def test_rejects_when_stock_is_gone_and_keeps_what_it_got():
+    store = make_store(5)
+    engine = make_engine(store)
+    with pytest.raises(InsufficientStock):
+        engine.reserve(items(c1=6))
+    assert engine.rejected == 1
+    assert stock(store, 1) == 0
+    # The 5 leased units still sell
+    engine.reserve(items(c1=5))
+    assert engine.held(1) == 0
+
+
+def test_order_gets_all_of_its_crops_or_none():
+    store = make_store(100, 1)
+    engine = make_engine(store)
+    with pytest.raises(InsufficientStock) as error:
+        engine.reserve(items(c1=2, c2=2))
+    assert error.value.crop_id == 2
+    assert engine.held(1) == 12  # Leased, but not taken by the rejected order
+
+
+def test_release_puts_a_reservation_back():
+    store = make_store(100)
+    engine = make_engine(store)
+    reservation = engine.reserve(items(c1=4))
+    engine.release(reservation)
+    assert engine.held(1) == 14
+
+
+def test_close_returns_unsold_stock():
+    store = make_store(100)
+    engine = make_engine(store)
+    engine.reserve(items(c1=4))
+    assert engine.close() == {1: 10}
+    assert stock(store, 1) == 96
+    assert store.tables['stock_leases'][0]['quantity'] == 4
+
+
+def test_return_idle_keeps_recently_used_crops():
+    store = make_store(100, 100)
+    engine = make_engine(store)
+    engine.reserve(items(c1=1))
+    engine._used_at[1] -= 60
+    engine.reserve(items(c2=1))
+    assert engine.return_idle(idle_for=30) == {1: 10}
+    assert engine.held(2) == 10
+
+
+def test_short_worker_gets_stock_another_one_holds():
+    store = make_store(20)
+    holder = make_engine(store)
+    holder.reserve(items(c1=5))
+    assert stock(store, 1) == 5  # The holder keeps 10 of the rest
+    other = make_engine(store)
+    with pytest.raises(InsufficientStock):
+        other.reserve(items(c1=8))
+    # Coming up short marked the crop wanted; the holder gives its stock back
+    assert store.wanted_stock([1]) == {1}
+    assert holder.return_wanted() == {1: 10}
+    other.reserve(items(c1=8))
+    # While the crop is wanted nobody leases more than they need
+    assert other.held(1) == 0
+    assert stock(store, 1) == 7
+
+
+def test_short_order_waits_for_a_polling_holder():
+    store = make_store(20)
+    holder = make_engine(store, demand_poll=0.02)
+    holder.reserve(items(c1=5))
+    other = make_engine(store, claim_wait=2)
+    started = time.monotonic()
+    other.reserve(items(c1=15))
+    assert time.monotonic() - started < 2
+    assert holder.given_back == 1
+    holder.close()
+
+
+def test_create_order_answers_409_when_stock_is_gone(monkeypatch):
+    import ai_service
+
+    store = make_store(3)
+    monkeypatch.setattr(ai_service, 'order_store', store)
+    monkeypatch.setattr(ai_service, 'inventory', make_engine(store))
+    response = ai_service.app.test_client().post('/api/orders', json={
+        'user_id': 1,
+        'items': [{'id': 1, 'name': 'Crop 1', 'price': 10.0, 'quantity': 4}],
+        'shipping_info': {'address': 'Farmgate, Dhaka', 'phone': '+8801700000000'},
+    })
+    assert response.status_code == 409
+    assert response.json['success'] is False
+    assert not store.tables.get('orders')
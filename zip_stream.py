@@ -0,0 +1,34 @@
+import zipfile
+
+
+class _ChunkSink:
+    """Write-only file object; zipfile falls back to streaming mode without tell()/seek()"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(files, compression=zipfile.ZIP_DEFLATED):
+    """Yield a ZIP archive piece by piece from an iterable of (name, bytes).
+
+    Only the file currently being added is held in memory; each one is
+    yielded as soon as it is written, then the central directory at the end.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=compression) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()